@@ -0,0 +1,137 @@
+"""
+Time every plot end to end on synthetic data.
+
+Writes synthetic files (see synthetic_data.py), then for each plot option
+and window times reading, masking, joining, drawing and saving the plot,
+each from a fresh dataset cache so the files are read every time. Results
+are saved as JSON, and can be compared with an earlier run to spot
+regressions:
+
+    python benchmarks/plots.py --output before.json
+    (change the code)
+    python benchmarks/plots.py --output after.json --compare before.json
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic_data import write_synthetic_files
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+import plotting_lidar
+
+
+
+def time_plot(option, files, output_location, reference_time, repeats, **render_options):
+    """
+    Seconds taken by each of repeats runs of making the plot for command
+    line option from files. The first run includes building the figure.
+    """
+    product = plotting_lidar.plot_option(option)[0]
+    times = []
+    for _ in range(repeats):
+        with plotting_lidar.DatasetCache() as dataset_cache:
+            start = time.perf_counter()
+            errors = plotting_lidar.run_product_plots(product, [option], files, output_location, reference_time,
+                                                      dataset_cache = dataset_cache, **render_options)
+            times.append(time.perf_counter() - start)
+        if errors[option] is not None:
+            raise RuntimeError(f'{option} failed:\n{errors[option]}')
+    return times
+
+
+
+def _versions():
+    import matplotlib, netCDF4, numpy
+    try:
+        commit = subprocess.run(['git', '-C', REPO, 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': numpy.__version__,
+            'matplotlib': matplotlib.__version__, 'netCDF4': netCDF4.__version__}
+
+
+
+def compare(results, previous, threshold):
+    """
+    Print how each plot's median time has changed since previous results,
+    returning the options which are more than threshold times slower.
+    """
+    slower = []
+    for option, result in results['plots'].items():
+        before = previous['plots'].get(option)
+        if before is None:
+            continue
+        ratio = result['median'] / before['median']
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            slower.append(option)
+        print(f"{option:32} {before['median']:8.3f} s -> {result['median']:8.3f} s  x{ratio:.2f}{flag}")
+    return slower
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Time plotting_lidar.py plots on synthetic data.')
+    parser.add_argument('options', nargs = '*', help = 'Plots to time, named as in PLOT_OPTIONS, e.g. stare_aerosol_backscatter_today, or for another window, e.g. stare_aerosol_backscatter_last72h. Default is all of PLOT_OPTIONS.')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'Times to make each plot. Default is 3.')
+    parser.add_argument('--days', type = int, default = None, help = 'Days of synthetic files to write. Default is as many as the plots need, at least 3.')
+    parser.add_argument('--data', default = None, help = 'Where to write the synthetic files. Default is a temporary directory.')
+    parser.add_argument('--stare-resolution', type = float, default = None, help = 'Seconds between stare records. Default is 10.')
+    parser.add_argument('--wind-profile-resolution', type = float, default = None, help = 'Seconds between wind profile records. Default is 60.')
+    parser.add_argument('--mean-winds-resolution', type = float, default = 600, help = 'Seconds between mean winds records. Default is 600.')
+    parser.add_argument('--gates', type = int, default = 200, help = 'Number of range gates in the backscatter products. Default is 200.')
+    parser.add_argument('--levels', type = int, default = 60, help = 'Number of altitudes in the mean winds product. Default is 60.')
+    parser.add_argument('--bin-to-pixels', choices = ['time', 'time-height'], default = None, help = 'Passed on to the plots.')
+    parser.add_argument('--logos', default = '.', help = 'Directory with the logo images the plots use. Default is the current directory.')
+    parser.add_argument('--output', default = None, help = 'JSON file to save the results to.')
+    parser.add_argument('--compare', default = None, help = 'JSON results of an earlier run to compare with.')
+    parser.add_argument('--threshold', type = float, default = 1.2, help = 'With --compare, fail if any plot is this many times slower. Default is 1.2.')
+    args = parser.parse_args()
+
+    options = args.options or list(plotting_lidar.PLOT_OPTIONS)
+    for name in ['data', 'output', 'compare']:
+        if getattr(args, name) is not None:
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    # the plots look for their logos in the current directory
+    os.chdir(args.logos)
+    # end the data part way through today, so today's file is partial as in real use
+    reference_time = dt.datetime.now(dt.timezone.utc).replace(hour = 18, minute = 0, second = 0, microsecond = 0)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        data_location = args.data or os.path.join(scratch, 'data')
+        output_location = os.path.join(scratch, 'plots')
+        os.makedirs(output_location)
+        print(f'Writing synthetic files to {data_location}')
+        days = args.days or max([3] + [ plotting_lidar.window_days(plotting_lidar.plot_option(option)[1], reference_time) for option in options ])
+        files = write_synthetic_files(data_location, days, reference_time, args.stare_resolution, args.wind_profile_resolution,
+                                      args.mean_winds_resolution, args.gates, args.levels)
+
+        results = {'date': dt.datetime.now(dt.timezone.utc).isoformat(timespec = 'seconds'), 'versions': _versions(),
+                   'parameters': {name: value for name, value in vars(args).items() if name not in ['options', 'output', 'compare', 'threshold', 'data', 'logos']},
+                   'plots': {}}
+        for option in options:
+            product = plotting_lidar.plot_option(option)[0]
+            times = time_plot(option, files[plotting_lidar.PRODUCT_FILE_NAMES[product]], output_location, reference_time, args.repeats,
+                              bin_to_pixels = args.bin_to_pixels)
+            results['plots'][option] = {'first': times[0], 'median': statistics.median(times), 'min': min(times), 'times': times}
+            print(f'{option:32} first {times[0]:.3f} s, median {statistics.median(times):.3f} s, min {min(times):.3f} s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        if slower:
+            sys.exit(f"Slower than before: {', '.join(slower)}")
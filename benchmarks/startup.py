@@ -0,0 +1,89 @@
+"""
+Check that plotting_lidar.py starts quickly.
+
+Times `python plotting_lidar.py -h` a number of times, reports the median
+and the slowest imports from `python -X importtime`, and exits with an
+error if the median is over --max-seconds or if importing the script loads
+matplotlib or netCDF4, which should only be imported to make a plot.
+
+    python benchmarks/startup.py --max-seconds 0.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plotting_lidar.py')
+
+# modules which should not be imported until a plot is made
+HEAVY_MODULES = ['matplotlib', 'netCDF4']
+
+
+
+def time_help(runs):
+    """
+    Wall clock seconds of each of runs calls of the script with -h.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT, '-h'], check = True, stdout = subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+
+def slowest_imports(count):
+    """
+    [(cumulative microseconds, module)] of the count slowest top level
+    imports when running the script with -h.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT, '-h'], check = True,
+                            stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # top level imports are the ones not indented
+        if not module[1:].startswith(' '):
+            imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse = True)[:count]
+
+
+
+def heavy_modules_imported():
+    """
+    Which of HEAVY_MODULES are loaded by importing the script.
+    """
+    check = (f'import sys; sys.path.insert(0, {os.path.dirname(SCRIPT)!r}); import plotting_lidar; '
+             f'print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', check], check = True, stdout = subprocess.PIPE, text = True)
+    return result.stdout.split()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Check the start up time of plotting_lidar.py.')
+    parser.add_argument('--runs', type = int, default = 10, help = 'Number of times to run the script. Default is 10.')
+    parser.add_argument('--max-seconds', type = float, default = 0.5, help = 'Fail if the median start up time is longer than this. Default is 0.5.')
+    args = parser.parse_args()
+
+    times = time_help(args.runs)
+    median = statistics.median(times)
+    print(f'plotting_lidar.py -h: median {median:.3f} s, min {min(times):.3f} s, max {max(times):.3f} s over {args.runs} runs')
+    print('Slowest imports:')
+    for cumulative, module in slowest_imports(5):
+        print(f'  {cumulative / 1e6:.3f} s  {module}')
+
+    failures = []
+    if median > args.max_seconds:
+        failures.append(f'median start up time {median:.3f} s is over {args.max_seconds} s')
+    heavy = heavy_modules_imported()
+    if heavy:
+        failures.append(f"importing plotting_lidar.py loads {', '.join(heavy)}")
+    if failures:
+        sys.exit('Start up regression: ' + '; '.join(failures))
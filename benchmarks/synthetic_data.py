@@ -0,0 +1,139 @@
+"""
+Write synthetic ncas-lidar-dop-2 netCDF files for benchmarking.
+
+Files are named and laid out like the real ones, with one stare,
+wind-profile and mean-winds-profile file for each day, filled with random
+but plausible values. The newest day's files end at --end (default now),
+as if the instrument were still recording.
+
+    python benchmarks/synthetic_data.py /tmp/lidar-data --days 3
+"""
+import argparse
+import datetime as dt
+import os
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+# product: (seconds between records, number of angles per record)
+BACKSCATTER_PRODUCTS = {
+    'aerosol-backscatter-radial-winds_stare': (10, 1),
+    'aerosol-backscatter-radial-winds_wind-profile': (60, 4),
+}
+MEAN_WINDS_PRODUCT = 'mean-winds-profile'
+
+
+
+def _filename(output_location, date, product, site = 'iao', version = '1.0'):
+    return f"{output_location}/ncas-lidar-dop-2_{site}_{date.strftime('%Y%m%d')}_{product}_v{version}.nc"
+
+
+
+def write_backscatter_file(filename, times, gates, angles, rng, gate_length = 30):
+    """
+    Stare or wind profile file: backscatter and its QC flag on (time,
+    range, angle), with range also (time, range, angle) as in the real
+    files.
+    """
+    with Dataset(filename, 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('index_of_range', gates)
+        nc.createDimension('index_of_angle', angles)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'seconds since 1970-01-01 00:00:00'
+        time[:] = times
+
+        shape = (len(times), gates, angles)
+        dims = ('time', 'index_of_range', 'index_of_angle')
+        range_ = nc.createVariable('range', 'f4', dims, zlib = True)
+        range_.units = 'm'
+        range_[:] = np.broadcast_to((np.arange(gates) * gate_length + gate_length / 2)[None,:,None], shape)
+
+        backscatter = nc.createVariable('attenuated_aerosol_backscatter_coefficient', 'f4', dims, zlib = True, fill_value = -1e20)
+        backscatter.units = 'm-1 sr-1'
+        backscatter[:] = 10 ** rng.uniform(-7, -3, shape)
+
+        qc = nc.createVariable('qc_flag_backscatter', 'i1', dims, zlib = True)
+        qc[:] = rng.integers(1, 3, shape)
+
+
+
+def write_mean_winds_file(filename, times, levels, rng, level_spacing = 50):
+    """
+    Mean winds profile file: wind components, speed and upward velocity
+    on (time, altitude).
+    """
+    with Dataset(filename, 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('altitude', levels)
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = 'seconds since 1970-01-01 00:00:00'
+        time[:] = times
+
+        altitude = nc.createVariable('altitude', 'f4', ('altitude',))
+        altitude.units = 'm'
+        altitude[:] = np.arange(levels) * level_spacing + 100
+
+        u = rng.normal(0, 5, (len(times), levels))
+        v = rng.normal(0, 5, (len(times), levels))
+        values = {'eastward_wind': u, 'northward_wind': v, 'wind_speed': np.hypot(u, v),
+                  'upward_air_velocity': rng.normal(0, 1, (len(times), levels))}
+        for name, data in values.items():
+            variable = nc.createVariable(name, 'f4', ('time', 'altitude'), zlib = True, fill_value = -1e20)
+            variable.units = 'm s-1'
+            variable[:] = data
+
+
+
+def write_synthetic_files(output_location, days = 3, end = None, stare_resolution = None, wind_profile_resolution = None,
+                          mean_winds_resolution = 600, gates = 200, levels = 60, seed = 0):
+    """
+    Write days of files of each product to output_location, the newest
+    ending at end (a UTC datetime, default now). Resolutions are seconds
+    between records, with the backscatter products defaulting to those in
+    BACKSCATTER_PRODUCTS. Returns {product: [files, oldest first]}.
+    """
+    os.makedirs(output_location, exist_ok = True)
+    if end is None:
+        end = dt.datetime.now(dt.timezone.utc)
+    resolutions = {'aerosol-backscatter-radial-winds_stare': stare_resolution,
+                   'aerosol-backscatter-radial-winds_wind-profile': wind_profile_resolution}
+    rng = np.random.default_rng(seed)
+    files = { product: [] for product in list(BACKSCATTER_PRODUCTS) + [MEAN_WINDS_PRODUCT] }
+    for n in reversed(range(days)):
+        day = dt.datetime.combine(end.date() - dt.timedelta(days = n), dt.time(), dt.timezone.utc)
+        day_end = min(end, day + dt.timedelta(days = 1)).timestamp()
+        for product, (resolution, angles) in BACKSCATTER_PRODUCTS.items():
+            filename = _filename(output_location, day, product)
+            times = np.arange(day.timestamp(), day_end, resolutions[product] or resolution)
+            write_backscatter_file(filename, times, gates, angles, rng)
+            files[product].append(filename)
+        filename = _filename(output_location, day, MEAN_WINDS_PRODUCT)
+        write_mean_winds_file(filename, np.arange(day.timestamp(), day_end, mean_winds_resolution), levels, rng)
+        files[MEAN_WINDS_PRODUCT].append(filename)
+    return files
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Write synthetic ncas-lidar-dop-2 netCDF files.')
+    parser.add_argument('output_location', help = 'Where to write the files.')
+    parser.add_argument('--days', type = int, default = 3, help = 'Number of days of files of each product. Default is 3.')
+    parser.add_argument('--end', type = dt.datetime.fromisoformat, default = None,
+                        help = 'UTC time the newest files end at, e.g. 2024-06-01T12:00. Default is now.')
+    parser.add_argument('--stare-resolution', type = float, default = None, help = 'Seconds between stare records. Default is 10.')
+    parser.add_argument('--wind-profile-resolution', type = float, default = None, help = 'Seconds between wind profile records. Default is 60.')
+    parser.add_argument('--mean-winds-resolution', type = float, default = 600, help = 'Seconds between mean winds records. Default is 600.')
+    parser.add_argument('--gates', type = int, default = 200, help = 'Number of range gates in the backscatter products. Default is 200.')
+    parser.add_argument('--levels', type = int, default = 60, help = 'Number of altitudes in the mean winds product. Default is 60.')
+    parser.add_argument('--seed', type = int, default = 0, help = 'Random number seed. Default is 0.')
+    args = parser.parse_args()
+
+    end = args.end
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo = dt.timezone.utc)
+    files = write_synthetic_files(args.output_location, args.days, end, args.stare_resolution, args.wind_profile_resolution,
+                                  args.mean_winds_resolution, args.gates, args.levels, args.seed)
+    for product_files in files.values():
+        print('\n'.join(product_files))
@@ -0,0 +1,104 @@
+"""
+Compare building plot time axes from datetime objects with time_to_mdates.
+
+Before time_to_mdates, each plot turned every netCDF time into a datetime
+and drew the data against a 2-D object array of them. This times building
+the time axis that way and with time_to_mdates, each followed by drawing
+and saving a backscatter plot of synthetic 1 Hz data, and reports the
+seconds taken and the peak memory above the input arrays. Each is run in
+its own process so their peak memory is measured separately.
+
+    python benchmarks/time_axis.py --profiles 8640 43200
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+
+
+def datetime_axis(times, heights, data):
+    """
+    Time axis as the plots used to build it: a datetime for every time,
+    repeated for every gate in a 2-D object array.
+    """
+    x = np.empty((len(times), len(heights)), dtype = object)
+    datetimes = [ dt.datetime.fromtimestamp(t, dt.timezone.utc) for t in times ]
+    for i in range(len(heights)):
+        x[:,i] = datetimes
+    return x, np.broadcast_to(heights, x.shape).copy(), data
+
+
+
+def mdates_axis(times, heights, data):
+    """
+    Time axis as the plots now build it, with time_to_mdates.
+    """
+    import plotting_lidar
+    return plotting_lidar.time_to_mdates(times), heights, data.T
+
+
+
+AXES = {'datetime': datetime_axis, 'mdates': mdates_axis}
+
+
+
+def run(axis, profiles, gates, output_file):
+    """
+    {'axis seconds', 'total seconds', 'peak_rss_bytes'} of building the
+    time axis with axis (a key of AXES) for profiles times of gates, then
+    drawing and saving it to output_file.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    times = np.arange(profiles, dtype = np.float64) + dt.datetime(2024, 6, 1, tzinfo = dt.timezone.utc).timestamp()
+    heights = np.arange(gates) * 30.
+    data = 10**np.random.default_rng(0).uniform(-7, -3, (profiles, gates)).astype(np.float32)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    x, y, values = AXES[axis](times, heights, data)
+    built = time.perf_counter()
+    fig, ax = plt.subplots(figsize = (20, 8))
+    ax.pcolormesh(x, y, values, norm = LogNorm(10**-7, 10**-3))
+    fig.savefig(output_file)
+    plt.close(fig)
+    end = time.perf_counter()
+    return {'axis seconds': built - start, 'total seconds': end - start,
+            'peak_rss_bytes': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base) * 1024}
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Compare building plot time axes from datetime objects with time_to_mdates.')
+    parser.add_argument('--profiles', type = int, nargs = '+', default = [8640, 43200], help = 'Numbers of profiles (1 Hz times) to plot. Default is 8640 43200.')
+    parser.add_argument('--gates', type = int, default = 300, help = 'Number of range gates. Default is 300.')
+    parser.add_argument('--axis', choices = list(AXES), default = None, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.axis is not None:
+        # one measurement, in a process of its own
+        with tempfile.TemporaryDirectory() as scratch:
+            print(json.dumps(run(args.axis, args.profiles[0], args.gates, os.path.join(scratch, 'plot.png'))))
+        sys.exit()
+
+    print(f"{'profiles':>8}  {'datetime':>22}  {'time_to_mdates':>22}")
+    for profiles in args.profiles:
+        results = {}
+        for axis in AXES:
+            output = subprocess.run([sys.executable, __file__, '--axis', axis, '--profiles', str(profiles), '--gates', str(args.gates)],
+                                    check = True, capture_output = True, text = True).stdout
+            results[axis] = json.loads(output.splitlines()[-1])
+        print(f'{profiles:>8}' + ''.join( f"  {results[axis]['total seconds']:>9.2f} s {results[axis]['peak_rss_bytes'] / 2**20:>7.0f} MB" for axis in AXES ))
@@ -0,0 +1,157 @@
+"""
+Index of ncas-lidar-dop-2 netCDF files, kept in a small SQLite database.
+
+Scanning a directory records each file's site, product, date, version,
+first and last timestamps, number of records, size and modification time.
+Later scans only open files that are new or have changed, so the index
+can be updated on every run, and files of a product between two times
+are then found with one query.
+
+    python lidar_catalog.py /path/to/netcdf_files --catalog catalog.sqlite
+"""
+import glob
+import os
+import re
+import sqlite3
+
+
+FILENAME_PATTERN = re.compile(r'ncas-lidar-dop-2_(?P<site>[^_]+)_(?P<date>\d{8})_(?P<product>.+)_v(?P<version>[\d.]+)\.nc$')
+
+
+
+def parse_filename(filename):
+    """
+    {'site', 'date', 'product', 'version'} from the name of an
+    ncas-lidar-dop-2 netCDF file, or None if it is not named like one.
+    """
+    match = FILENAME_PATTERN.search(os.path.basename(filename))
+    if match is None:
+        return None
+    return match.groupdict()
+
+
+
+def _version_key(version):
+    return tuple(int(part) for part in version.split('.') if part.isdigit())
+
+
+
+class Catalog:
+    """
+    SQLite index of netCDF files, stored in database (a file name, or
+    ':memory:'), waiting up to timeout seconds for other processes
+    writing to it.
+    """
+    def __init__(self, database, timeout = 60):
+        self.connection = sqlite3.connect(database, timeout = timeout)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                                       path TEXT PRIMARY KEY, directory TEXT, site TEXT, product TEXT, date TEXT, version TEXT,
+                                       first_time REAL, last_time REAL, records INTEGER, size INTEGER, mtime_ns INTEGER)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_product_time ON files (product, last_time, first_time)')
+        self.connection.commit()
+
+    def update(self, directory):
+        """
+        Bring the index of directory up to date, reading only new and
+        changed files. Files that cannot be read are left out until they
+        change. Returns the number of files read.
+        """
+        directory = os.path.abspath(directory)
+        known = { path: (size, mtime_ns) for path, size, mtime_ns in
+                  self.connection.execute('SELECT path, size, mtime_ns FROM files WHERE directory = ?', (directory,)) }
+        found = set()
+        rows = []
+        for path in glob.glob(os.path.join(directory, 'ncas-lidar-dop-2_*.nc')):
+            name = parse_filename(path)
+            if name is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.add(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            # only imported when there is a file to read, as it is slow to import
+            from netCDF4 import Dataset
+            try:
+                with Dataset(path) as nc:
+                    times = nc['time']
+                    records = len(times)
+                    first_time = float(times[0]) if records else None
+                    last_time = float(times[-1]) if records else None
+            except (OSError, IndexError):
+                # e.g. still being created, so try again when it changes
+                found.discard(path)
+                continue
+            rows.append((path, directory, name['site'], name['product'], name['date'], name['version'],
+                         first_time, last_time, records, stat.st_size, stat.st_mtime_ns))
+        # written once everything is read, so the database is only locked briefly
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [ (path,) for path in set(known) - found ])
+        return len(rows)
+
+    def files(self, product, start, end, site = None):
+        """
+        Files of product (as in the file names, e.g. 'mean-winds-profile')
+        with records between timestamps start and end, oldest first. Where
+        a day has several versions only the latest is given. Raises
+        ValueError if site is not given and the files are from more than
+        one site, as their records cannot be joined into one series.
+        """
+        query = 'SELECT path, site, date, version FROM files WHERE product = ? AND last_time > ? AND first_time <= ?'
+        parameters = [product, start, end]
+        if site is not None:
+            query += ' AND site = ?'
+            parameters.append(site)
+        latest = {}
+        for path, file_site, date, version in self.connection.execute(query + ' ORDER BY first_time', parameters):
+            if (file_site, date) not in latest or _version_key(version) > _version_key(latest[(file_site, date)][1]):
+                latest[(file_site, date)] = (path, version)
+        sites = sorted({ file_site for file_site, _ in latest })
+        if site is None and len(sites) > 1:
+            raise ValueError(f"files of {product} from several sites ({', '.join(sites)}), choose one")
+        return [ path for path, _ in sorted(latest.values(), key = lambda file: parse_filename(file[0])['date']) ]
+
+    def sites(self):
+        """
+        Sites of the indexed files, in order.
+        """
+        return [ site for site, in self.connection.execute('SELECT DISTINCT site FROM files ORDER BY site') ]
+
+    def date(self, path):
+        """
+        Date (YYYYMMDD) of the indexed file path.
+        """
+        return self.connection.execute('SELECT date FROM files WHERE path = ?', (path,)).fetchone()[0]
+
+    def times(self, path):
+        """
+        (first, last) timestamps of the records of the indexed file path,
+        or None if it is not indexed.
+        """
+        return self.connection.execute('SELECT first_time, last_time FROM files WHERE path = ?', (path,)).fetchone()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Update the index of ncas-lidar-dop-2 netCDF files in a directory.')
+    parser.add_argument('directory', help = 'Directory of netCDF files.')
+    parser.add_argument('--catalog', default = 'ncas-lidar-dop-2_catalog.sqlite', help = 'SQLite file to keep the index in. Default is ncas-lidar-dop-2_catalog.sqlite.')
+    args = parser.parse_args()
+
+    with Catalog(args.catalog) as catalog:
+        print(f'Read {catalog.update(args.directory)} new or changed files')
+        for product, nfiles, first, last in catalog.connection.execute('SELECT product, COUNT(*), MIN(date), MAX(date) FROM files GROUP BY product'):
+            print(f'{product}: {nfiles} files, {first} to {last}')
@@ -1,655 +1,2104 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import matplotlib.image as image
-from matplotlib.colors import LogNorm
+# matplotlib and netCDF4 are imported where they are used, so that the
+# command line starts quickly and only pays for them when making plots
 import numpy as np
 import datetime as dt
-from netCDF4 import Dataset
+import glob
+import hashlib
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+
+from lidar_catalog import Catalog, parse_filename
 
 
 """
 Useful functions
 """
 
-def set_major_minor_date_ticks(ax):
-    ax.xaxis.set_minor_locator(mdates.HourLocator(byhour=range(0,24,2)))
+def set_major_minor_date_ticks(ax, minor_hours = 2, daily = True):
+    # without a midnight on the axis the hours are labelled with the date instead
+    import matplotlib.dates as mdates
+    ax.xaxis_date()
+    ax.xaxis.set_minor_locator(mdates.HourLocator(byhour=range(0,24,minor_hours)))
     ax.xaxis.set_minor_formatter(mdates.DateFormatter("%H:%M"))
-    ax.xaxis.set_major_locator(mdates.DayLocator())
+    ax.xaxis.set_major_locator(mdates.DayLocator() if daily else mdates.HourLocator(byhour=range(0,24,minor_hours)))
     ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M\n%Y/%m/%d"))
     
     
     
-"""
-Plots for today's data
-"""
-
-def stare_aerosol_backscatter_today(stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def minor_tick_hours(days):
     """
-    Create plot of aerosol backscatter from Stare data
+    Hours between the labelled minor ticks of a time axis days long, so
+    that there are no more than 24 of them however long it is.
     """
-    stare_today_dataset = Dataset(stare_today_file)
-    
-    y_2d = stare_today_dataset['range'][:,:,0]
-    x_2d = np.empty(y_2d.shape, dtype=object)
-    dt_times = [ dt.datetime.fromtimestamp(j, dt.timezone.utc) for j in stare_today_dataset['time'][:] ]
-    for i in range(y_2d.shape[1]):
-        x_2d[:,i] = dt_times
-        
-    im = image.imread(image_file)
+    return next((hours for hours in (2, 3, 4, 6, 12) if days * 24 // hours <= 24), 24)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    if only_good_data:
-        data = np.ma.masked_where(stare_today_dataset['qc_flag_backscatter'][:] > 1, stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-    else:
-        data = stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-    c = ax.pcolormesh(x_2d,y_2d,data[:,:,0],norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
     
-    set_major_minor_date_ticks(ax)
-
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
+def time_to_mdates(times):
+    """
+    Convert times in seconds since 1970-01-01 00:00:00 UTC to matplotlib
+    date numbers in one vectorised step, rather than one datetime object
+    per sample.
+    """
+    import matplotlib.dates as mdates
+    return np.asarray(times, dtype=np.float64) / 86400 + mdates.date2num(np.datetime64('1970-01-01T00:00:00'))
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {stare_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
-
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_today_qc.png')
-    else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_today.png')
-    plt.close()
     
-    
-
-def wind_profile_aerosol_backscatter_today(wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def first_record_after(times, cutoff):
     """
-    Create plot of aerosol backscatter from Wind Profile data
+    Index of the first of the sorted times later than cutoff, found by
+    binary search, so that [index:] is a contiguous read of every record
+    after cutoff.
     """
-    wp_today_dataset = Dataset(wp_today_file)
+    return int(np.searchsorted(times, cutoff, side='right'))
     
-    y_2d = wp_today_dataset['range'][:,:,0]
-    x_2d = np.empty(y_2d.shape, dtype=object)
-    dt_times = [ dt.datetime.fromtimestamp(j, dt.timezone.utc) for j in wp_today_dataset['time'][:] ]
-    for i in range(y_2d.shape[1]):
-        x_2d[:,i] = dt_times
-        
-    im = image.imread(image_file)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    if only_good_data:
-        data = np.ma.masked_where(wp_today_dataset['qc_flag_backscatter'][:] > 1, wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-    else:
-        data = wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
+def _index_key(index):
+    """
+    Hashable version of a netCDF index made of slices and integers.
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    return tuple((i.start, i.stop, i.step) if isinstance(i, slice) else i for i in index)
     
-    c = ax.pcolormesh(x_2d,y_2d,data[:,:,0],norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
     
-    set_major_minor_date_ticks(ax)
-
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {wp_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
-
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
+class DatasetCache:
+    """
+    Run-scoped pool of netCDF datasets and decoded variables.
     
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_today_qc.png')
+    Each file is opened once, and each variable decoded once, however many
+    plots ask for it. Use as a context manager, or call close() when done.
+    """
+    def __init__(self):
+        self._datasets = {}
+        self._variables = {}
+        
+    def dataset(self, filename):
+        if filename not in self._datasets:
+            from netCDF4 import Dataset
+            with phase('open', file = filename):
+                self._datasets[filename] = Dataset(filename)
+        return self._datasets[filename]
+        
+    def variable(self, filename, variable, index = slice(None)):
+        """
+        Return decoded contents of variable[index] in filename, reading
+        only that hyperslab from the file. index is a slice, an integer or
+        a tuple of them, e.g. np.s_[:,:,0]. The returned array is shared
+        between callers, so must not be modified in place.
+        """
+        key = (filename, variable, _index_key(index))
+        if key not in self._variables:
+            nc_variable = self.dataset(filename)[variable]
+            with phase('read', file = filename, variable = variable) as sizes:
+                self._variables[key] = nc_variable[index]
+                sizes['bytes'] = self._variables[key].nbytes
+        return self._variables[key]
+        
+    def units(self, filename, variable):
+        return self.dataset(filename)[variable].units
+        
+    def evict(self, filename):
+        """
+        Close filename and forget its decoded variables.
+        """
+        dataset = self._datasets.pop(filename, None)
+        if dataset is not None:
+            dataset.close()
+        self._variables = { key: data for key, data in self._variables.items() if key[0] != filename }
+        
+    def close(self):
+        for dataset in self._datasets.values():
+            dataset.close()
+        self._datasets = {}
+        self._variables = {}
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+        
+        
+class ArrayCache:
+    """
+    On-disk cache of decoded, plot-ready arrays, so files which have not
+    changed are not decompressed again on every run.
+    
+    Each array is stored in directory as a .npy file, keyed by the path,
+    size and modification time of the netCDF file it came from, and is
+    memory-mapped back. Files modified in the last min_age seconds, such
+    as today's, are taken to be still growing: the records read from them
+    so far are kept, keyed by path alone, and only records added since
+    are read next time. Once the cache is over max_bytes the least
+    recently used arrays are deleted.
+    """
+    def __init__(self, directory, max_bytes = 2 * 2**30, min_age = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        
+    def _path(self, *key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+        
+    def array(self, filename, name, read, count, only_good_data = False):
+        """
+        Variable name of filename, as decoded by read(records), which gives
+        a slice of its records and is only called for those not already in
+        the cache. count() is the number of records in the file.
+        """
+        stat = os.stat(filename)
+        if time.time() - stat.st_mtime < self.min_age:
+            return self._growing(filename, name, read, count, only_good_data, stat)
+            
+        path = self._path(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, name, only_good_data) + '.npy'
+        try:
+            array = np.load(path, mmap_mode = 'r')
+        except (OSError, ValueError):
+            pass
+        else:
+            try:
+                # the modification time orders entries by when last used
+                os.utime(path)
+            except OSError:
+                pass
+            return array
+            
+        array = read(slice(None))
+        self._store(path, array)
+        # the file has stopped growing, so what was kept of it as it grew is no longer needed
+        self._remove(self._path(os.path.abspath(filename), name, only_good_data) + '.growing')
+        return array
+        
+    def _growing(self, filename, name, read, count, only_good_data, stat):
+        """
+        array() for a file which is still being added to. The entry is
+        locked while it is read and changed, as other processes, e.g. a
+        cron run and --watch, may be updating it too.
+        """
+        import fcntl
+        path = self._path(os.path.abspath(filename), name, only_good_data) + '.growing'
+        os.makedirs(self.directory, exist_ok = True)
+        with open(f'{path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            records = count()
+            try:
+                with open(f'{path}.json') as f:
+                    kept = json.load(f)
+                row_bytes = np.dtype(kept['dtype']).itemsize * int(np.prod(kept['shape']))
+                if os.path.getsize(path) < kept['records'] * row_bytes:
+                    # evicted, or cut short
+                    kept = None
+            except (OSError, ValueError, KeyError, TypeError):
+                kept = None
+            if kept is not None and (stat.st_size < kept['size'] or stat.st_mtime_ns < kept['mtime_ns'] or records < kept['records']):
+                # rewritten rather than added to, so start again
+                kept = None
+            first = 0 if kept is None else kept['records']
+            new = np.ascontiguousarray(read(slice(first, records)))
+            if kept is not None and (new.dtype.str != kept['dtype'] or list(new.shape[1:]) != kept['shape']):
+                first = 0
+                new = np.ascontiguousarray(read(slice(0, records)))
+            if records == 0:
+                return new
+                
+            with open(path, 'r+b' if first else 'wb') as f:
+                # drop anything written after the last complete update
+                f.truncate(first * new.dtype.itemsize * int(np.prod(new.shape[1:])))
+                f.seek(0, os.SEEK_END)
+                f.write(new.tobytes())
+            with open(f'{path}.json.{os.getpid()}.tmp', 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'records': records,
+                           'dtype': new.dtype.str, 'shape': list(new.shape[1:])}, f)
+            os.replace(f'{path}.json.{os.getpid()}.tmp', f'{path}.json')
+            # copied while locked, as another process may rewrite the entry once it is not
+            return np.fromfile(path, dtype = new.dtype, count = records * int(np.prod(new.shape[1:]))).reshape((records,) + new.shape[1:])
+            
+    def _store(self, path, array):
+        os.makedirs(self.directory, exist_ok = True)
+        # write then rename, so other processes never see half an array
+        with open(f'{path}.{os.getpid()}.tmp', 'wb') as f:
+            np.save(f, np.asarray(array))
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+        
+        entries = []
+        for entry in glob.glob(os.path.join(self.directory, '*.npy')) + glob.glob(os.path.join(self.directory, '*.growing')):
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(entry)
+            total -= size
+            
+    def _remove(self, entry):
+        import fcntl
+        # an entry still growing is not removed while another process is updating it
+        with open(f'{entry}.lock', 'w') if entry.endswith('.growing') else nullcontext() as lock:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            for f in [entry, f'{entry}.json']:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+                
+                
+                
+@contextmanager
+def use_dataset_cache(dataset_cache = None):
+    """
+    Yield dataset_cache if given, otherwise a new DatasetCache that is
+    closed on exit, so plot functions never leave files open.
+    """
+    if dataset_cache is not None:
+        yield dataset_cache
     else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_today.png')
-    plt.close()
-    
-    
-    
-def wind_profile_mean_winds_speed_direction_today(meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = 5):
+        with DatasetCache() as cache:
+            yield cache
+            
+            
+            
+def _reset_peak_rss():
+    # Linux lets the peak be reset, so each outermost phase gets its own
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+        
+        
+        
+class Metrics:
     """
-    Create plot of wind speed and direction from Wind Profile data
+    Wall time and peak memory of each phase of making plots, e.g. opening
+    files, reading variables, drawing and saving.
+    
+    Each record is a dict of the plot (or product, while its files are
+    read), phase, seconds, peak_rss_bytes and any sizes of its inputs.
+    Peak RSS is reset where the OS allows it as a phase starts while no
+    other is under way, in any thread, so it is from the start of the
+    outermost phase a phase is part of, otherwise the peak of the process
+    so far. It includes any phases in other threads at the same time.
+    """
+    def __init__(self):
+        self.records = []
+        # the plot of each thread, as files are read ahead in the background
+        self._current = threading.local()
+        # phases under way, so one inside another does not reset the outer one's peak
+        self._depth = 0
+        self._depth_lock = threading.Lock()
+        
+    @property
+    def plot(self):
+        return getattr(self._current, 'plot', None)
+        
+    @plot.setter
+    def plot(self, plot):
+        self._current.plot = plot
+        
+    @contextmanager
+    def phase(self, name, **sizes):
+        with self._depth_lock:
+            if self._depth == 0:
+                _reset_peak_rss()
+            self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield sizes
+        finally:
+            self.add(name, time.perf_counter() - start, **sizes)
+            with self._depth_lock:
+                self._depth -= 1
+            
+    def add(self, name, seconds, **sizes):
+        """
+        Record phase name of the current plot, timed elsewhere, e.g. in
+        another thread.
+        """
+        import resource
+        self.records.append({'plot': self.plot, 'phase': name, 'seconds': seconds,
+                             'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, **sizes})
+            
+    def write(self, filename):
+        """
+        Append the records to filename as JSON lines, or if filename ends
+        in .prom replace it with a Prometheus textfile collector file of
+        the total seconds and largest peak RSS of each plot and phase.
+        """
+        if not filename.endswith('.prom'):
+            with open(filename, 'a') as f:
+                for record in self.records:
+                    f.write(json.dumps(record) + '\n')
+            return
+            
+        seconds = Counter()
+        peak_rss = {}
+        for record in self.records:
+            key = (record['plot'], record['phase'])
+            seconds[key] += record['seconds']
+            peak_rss[key] = max(peak_rss.get(key, 0), record['peak_rss_bytes'])
+        lines = ['# HELP lidar_plot_phase_seconds Wall time spent in each phase of making a plot.',
+                 '# TYPE lidar_plot_phase_seconds gauge']
+        lines += [ f'lidar_plot_phase_seconds{{plot="{plot}",phase="{phase}"}} {value}' for (plot, phase), value in seconds.items() ]
+        lines += ['# HELP lidar_plot_phase_peak_rss_bytes Peak resident memory during each phase of making a plot.',
+                  '# TYPE lidar_plot_phase_peak_rss_bytes gauge']
+        lines += [ f'lidar_plot_phase_peak_rss_bytes{{plot="{plot}",phase="{phase}"}} {value}' for (plot, phase), value in peak_rss.items() ]
+        # write then rename, so the collector never reads half a file
+        with open(f'{filename}.{os.getpid()}.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f'{filename}.{os.getpid()}.tmp', filename)
+        
+        
+        
+# Metrics being recorded in this process, if any
+_metrics = None
+
+
+
+def phase(name, **sizes):
+    """
+    Context manager recording name as a phase of the current plot, if
+    metrics are being recorded. It gives a dict of input sizes, which can
+    be added to while in the phase.
     """
-    meanwind_today_dataset = Dataset(meanwind_today_file)
+    if _metrics is None:
+        return nullcontext({})
+    return _metrics.phase(name, **sizes)
     
-    im = image.imread(image_file)
     
-    u = meanwind_today_dataset['eastward_wind'][:]
-    v = meanwind_today_dataset['northward_wind'][:]
+"""
+Reading data
+"""
+
+# units of the length of a window named like 'last6h' or 'last7d'
+WINDOW_UNITS = {'h': 'hours', 'd': 'days'}
+
+
+
+def window_length(window):
+    """
+    dt.timedelta a window covers: 'last24' or 'last48' hours, or 'last'
+    followed by a number of hours or days, e.g. 'last6h' or 'last7d'.
+    None for 'today', which is all of the newest file.
+    """
+    if window == 'today':
+        return None
+    length = window[len('last'):]
+    if window.startswith('last') and length.isdigit() and int(length) > 0:
+        return dt.timedelta(hours = int(length))
+    number, unit = length[:-1], length[-1:]
+    if not window.startswith('last') or not number.isdigit() or int(number) == 0 or unit not in WINDOW_UNITS:
+        raise ValueError(f"unknown window {window!r}, expected 'today' or e.g. 'last6h' or 'last7d'")
+    return dt.timedelta(**{WINDOW_UNITS[unit]: int(number)})
     
-    y = meanwind_today_dataset['altitude'][:]
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in meanwind_today_dataset['time'][:] ]
     
-    x,y = np.meshgrid(x,y)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
+def window_start(window, reference_time = None):
+    """
+    Timestamp after which records are in window (see window_length)
+    ending at reference_time, default now. None for today, which is all
+    of today's file.
+    """
+    if window == 'today':
+        return None
+    if reference_time is None:
+        reference_time = dt.datetime.now(dt.timezone.utc)
+    return (reference_time - window_length(window)).timestamp()
     
-    pc = ax.pcolormesh(x,y,meanwind_today_dataset['wind_speed'][:].T)
     
-    set_major_minor_date_ticks(ax)
     
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
-    ax.grid(which='both')
+def window_days(window, reference_time = None):
+    """
+    Number of daily files, up to reference_time's (default now), that
+    window has records from.
+    """
+    if window == 'today':
+        return 1
+    if reference_time is None:
+        reference_time = dt.datetime.now(dt.timezone.utc)
+    return (reference_time.date() - (reference_time - window_length(window)).date()).days + 1
     
-    cbar = fig.colorbar(pc, ax = ax)
-    cbar.ax.set_ylabel('Wind speed (m s-1)')
-    ax.barbs(x[::barb_interval,::barb_interval], y[::barb_interval,::barb_interval], u[::barb_interval,::barb_interval].T, v[::barb_interval,::barb_interval].T, length = 7)
     
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_speed-direction_today.png')
-    plt.close()
+def window_files(files, window, reference_time = None):
+    """
+    Those of files, named like ncas-lidar-dop-2 netCDF files and given
+    oldest first, from the days window ending at reference_time (default
+    now) has records from. A day without a file is just left out.
+    """
+    if reference_time is None:
+        reference_time = dt.datetime.now(dt.timezone.utc)
+    first = (reference_time.date() - dt.timedelta(days = window_days(window, reference_time) - 1)).strftime('%Y%m%d')
+    return [ f for f in files if first <= parse_filename(f)['date'] <= reference_time.strftime('%Y%m%d') ]
     
     
     
-def wind_profile_mean_winds_upward_velocity_today(meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png'):
+class TimeSeries:
     """
-    Create plot of upward air velocity from Wind Profile data
+    Plotted variables of one product, joined across files.
+    
+    times are in seconds since 1970-01-01 00:00:00 UTC, heights are the
+    range or altitude of each gate, and each variable is a (time, height)
+    array. file_starts holds the index of the first record from each file.
+    unfiltered holds, for variables read with bad data set to NaN, their
+    values before that was done, if they were kept. Where there are more
+    than FILE_GAP seconds between one file's records and the next's, e.g.
+    as a day's file is missing, a record of NaN is added at either side of
+    the gap so that it is plotted blank.
+    """
+    def __init__(self, times, heights, variables, units, file_starts, unfiltered = None):
+        self.times = times
+        self.heights = heights
+        self.variables = variables
+        self.units = units
+        self.file_starts = file_starts
+        self.unfiltered = unfiltered or {}
+        
+    def __getitem__(self, variable):
+        return self.variables[variable]
+        
+    def records_from(self, start):
+        """
+        TimeSeries of records start onwards, sharing this one's arrays.
+        """
+        return TimeSeries(self.times[start:], self.heights,
+                          { name: data[start:] for name, data in self.variables.items() },
+                          self.units, [0] + [ s - start for s in self.file_starts if s > start ],
+                          { name: data[start:] for name, data in self.unfiltered.items() })
+        
+    def window(self, window, reference_time = None):
+        """
+        Records in window (see window_length) ending at reference_time.
+        Today is every record from the newest file.
+        """
+        if window == 'today':
+            return self.records_from(self.file_starts[-1])
+        return self.records_from(first_record_after(self.times, window_start(window, reference_time)))
+        
+        
+        
+# seconds between the records of two files over which the plots are left
+# blank, rather than the records either side being drawn across the gap
+FILE_GAP = 3600
+
+
+
+def _blank_gaps(series):
+    """
+    series, with a record of NaN added just after and just before each
+    gap of more than FILE_GAP seconds between its files' records.
+    """
+    starts = [ start for start in sorted(set(series.file_starts)) if 0 < start < len(series.times)
+               and series.times[start] - series.times[start - 1] > FILE_GAP ]
+    if not starts:
+        return series
+    # inserted before each start: one a second after the record before, one a second before the start
+    where = np.repeat(starts, 2)
+    times = np.insert(series.times, where, [ t for start in starts for t in (series.times[start - 1] + 1, series.times[start] - 1) ])
+    blank = lambda data: np.insert(data, where, np.nan, axis = 0)
+    return TimeSeries(times, series.heights, { name: blank(data) for name, data in series.variables.items() }, series.units,
+                      [ start + 2 * int(np.searchsorted(starts, start, side = 'right')) for start in series.file_starts ],
+                      { name: blank(data) for name, data in series.unfiltered.items() })
+                      
+                      
+                      
+# variable: its QC flag variable, which is over 1 where the data is bad
+QC_FLAGS = {'attenuated_aerosol_backscatter_coefficient': 'qc_flag_backscatter'}
+
+
+
+def _read_values(out, cache, filename, name, records, only_good_data, unfiltered = None):
+    """
+    Read the slice records of variable name in filename into float32
+    array out, with NaN for fill values and, if only_good_data, for data
+    QC_FLAGS marks as bad, the values before that being copied into
+    unfiltered if given. Only the first index of any third dimension is
+    read. Not read through the cache, which would keep a second copy.
     """
-    meanwind_today_dataset = Dataset(meanwind_today_file)
+    nc_variable = cache.dataset(filename)[name]
+    index = (records, slice(None), 0)[:nc_variable.ndim]
+    values = nc_variable[index]
+    out[...] = np.ma.getdata(values)
+    if np.ma.getmask(values) is not np.ma.nomask:
+        out[values.mask] = np.nan
+    del values
+    if unfiltered is not None:
+        unfiltered[...] = out
+    if only_good_data and name in QC_FLAGS:
+        _mask_bad(out, cache, filename, name, records)
+        
+        
+        
+def _mask_bad(values, cache, filename, name, records):
+    """
+    Set the data in values, the slice records of variable name in
+    filename, to NaN where QC_FLAGS marks it as bad. Returns values.
+    """
+    nc_flag = cache.dataset(filename)[QC_FLAGS[name]]
+    values[nc_flag[(records, slice(None), 0)[:nc_flag.ndim]] > 1] = np.nan
+    return values
+        
+        
+        
+def _heights_and_units(cache, filename, variables, height_variable):
+    if cache.dataset(filename)[height_variable].ndim == 1:
+        heights = cache.variable(filename, height_variable)
+    else:
+        heights = cache.variable(filename, height_variable, np.s_[0,:,0])
+    return heights, { name: getattr(cache.dataset(filename)[name], 'units', '') for name in variables }
     
-    y = meanwind_today_dataset['altitude'][:]
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in meanwind_today_dataset['time'][:] ]
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    c = ax.pcolormesh(x,y,meanwind_today_dataset['upward_air_velocity'][:].T, cmap='RdBu_r', vmin = -5, vmax = 5)
+def _read_records(cache, filename, name, records, only_good_data):
+    """
+    Slice records of variable name in filename, read as by _read_values
+    into a new array.
+    """
+    nrecords = len(range(*records.indices(_record_count(cache, filename))))
+    values = np.empty((nrecords, cache.dataset(filename)[name].shape[1]), dtype = np.float32)
+    _read_values(values, cache, filename, name, records, only_good_data)
+    return values
     
-    set_major_minor_date_ticks(ax)
     
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Upward air velocity {meanwind_today_dataset['upward_air_velocity'].units}")
+def _record_count(cache, filename):
+    return len(cache.dataset(filename).dimensions['time'])
     
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_upward-velocity_today.png')
-    plt.close()
-
     
-"""
-Plots for last 24 hours
-"""
-
-def stare_aerosol_backscatter_last24(stare_yesterday_file, stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def load_time_series(files, variables, height_variable, start = None, dataset_cache = None, only_good_data = False, array_cache = None, end = None,
+                     keep_unfiltered = False):
     """
-    Create plot of aerosol backscatter from Stare data for last 24 hours
+    Read variables from files, given oldest first, into one TimeSeries.
+    If start is given only records after that timestamp are kept, and if
+    end is given only those up to it, each file being read as one
+    contiguous slice of records. Only the first index of any third
+    dimension is read.
+    
+    Each variable is read straight into its part of one float32 array
+    sized for all the files, with fill values as NaN. If only_good_data
+    is True, data QC_FLAGS marks as bad is also set to NaN as it is read,
+    and if keep_unfiltered is True as well the values from before that are
+    kept in the TimeSeries' unfiltered, so that plots with and without the
+    bad data can be made from one read of the files.
+    
+    If array_cache, an ArrayCache, is given, files are decoded into it,
+    only the records added since last time for a file still growing, and
+    the records wanted copied from there.
     """
-    stare_yesterady_dataset = Dataset(stare_yesterday_file)
-    stare_today_dataset = Dataset(stare_today_file)
-    
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_24 = current_time - dt.timedelta(days=1)
-    time_minus_24_timestamp = time_minus_24.timestamp()
-    
-    y_locs = np.where(stare_yesterady_dataset['time'][:] > time_minus_24_timestamp)[0]
-    
-    y_times = stare_yesterady_dataset['time'][:][y_locs]
-    t_times = stare_today_dataset['time'][:]
-    times = np.hstack((y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
+    with use_dataset_cache(dataset_cache) as cache:
+        times = []
+        firsts = []
+        file_starts = []
+        nrecords = 0
+        for f in files:
+            if array_cache is None:
+                file_times = cache.variable(f, 'time')
+            else:
+                file_times = array_cache.array(f, 'time', lambda records: np.ma.getdata(cache.dataset(f)['time'][records]), lambda: _record_count(cache, f))
+            first = 0 if start is None else first_record_after(file_times, start)
+            last = len(file_times) if end is None else max(first, first_record_after(file_times, end))
+            firsts.append(first)
+            file_starts.append(nrecords)
+            nrecords += last - first
+            times.append(np.ma.getdata(file_times[first:last]))
+            
+        data = {}
+        unfiltered = {}
+        for name in variables:
+            keep = keep_unfiltered and only_good_data and name in QC_FLAGS
+            for f, first, file_start, file_times in zip(files, firsts, file_starts, times):
+                records = slice(first, first + len(file_times))
+                with phase('read', file = f, variable = name, cached = array_cache is not None) as sizes:
+                    whole = None
+                    whole_unfiltered = None
+                    if array_cache is not None and keep:
+                        # the bad data is masked from the unfiltered values, rather than decoded again
+                        whole_unfiltered = array_cache.array(f, name, lambda records: _read_records(cache, f, name, records, False),
+                                                             lambda: _record_count(cache, f))
+                        whole = array_cache.array(f, name, lambda records: _mask_bad(np.array(whole_unfiltered[records]), cache, f, name, records),
+                                                  lambda: _record_count(cache, f), only_good_data)
+                    elif array_cache is not None:
+                        whole = array_cache.array(f, name, lambda records: _read_records(cache, f, name, records, only_good_data),
+                                                  lambda: _record_count(cache, f), only_good_data)
+                    if name not in data:
+                        ngates = cache.dataset(f)[name].shape[1] if whole is None else whole.shape[1]
+                        data[name] = np.empty((nrecords, ngates), dtype = np.float32)
+                        if keep:
+                            unfiltered[name] = np.empty((nrecords, ngates), dtype = np.float32)
+                    region = data[name][file_start:file_start + len(file_times)]
+                    unfiltered_region = unfiltered[name][file_start:file_start + len(file_times)] if keep else None
+                    sizes['bytes'] = region.nbytes * (2 if keep else 1)
+                    if whole is None:
+                        _read_values(region, cache, f, name, records, only_good_data, unfiltered_region)
+                    else:
+                        region[...] = whole[records]
+                        if keep:
+                            unfiltered_region[...] = whole_unfiltered[records]
+                            
+        heights, units = _heights_and_units(cache, files[-1], variables, height_variable)
+        return _blank_gaps(TimeSeries(np.concatenate(times), heights, data, units, file_starts, unfiltered))
         
-    
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
-    
-    if only_good_data:
-        data_y = np.ma.masked_where(stare_yesterady_dataset['qc_flag_backscatter'][y_locs,:,:] > 1, stare_yesterady_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:])
-        data_t = np.ma.masked_where(stare_today_dataset['qc_flag_backscatter'][:] > 1, stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data = np.ma.vstack((data_y,data_t))
-    else:
-        data_y = stare_yesterady_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:]
-        data_t = stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data = np.vstack((data_y,data_t))
         
-    c = ax.pcolormesh(x,stare_today_dataset['range'][0,:,0],data[:,:,0].T,norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
-    
-    set_major_minor_date_ticks(ax)
+        
+def join_time_series(parts):
+    """
+    TimeSeries joining parts, the TimeSeries of files given oldest first,
+    with the heights and units of the newest.
+    """
+    offsets = np.cumsum([0] + [ len(part.times) for part in parts[:-1] ])
+    return _blank_gaps(TimeSeries(np.concatenate([ part.times for part in parts ]), parts[-1].heights,
+                      { name: np.concatenate([ part[name] for part in parts ]) for name in parts[-1].variables },
+                      parts[-1].units, [ int(offset + start) for offset, part in zip(offsets, parts) for start in part.file_starts ],
+                      { name: np.concatenate([ part.unfiltered[name] for part in parts ]) for name in parts[-1].unfiltered }))
+                      
+                      
+                      
+# bytes held per value while streaming: the decoded value, its QC flag and
+# the temporaries of binning it
+_STREAM_BYTES_PER_VALUE = 24
 
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
-    
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {stare_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
 
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
-    
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_last24_qc.png')
-    else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_last24.png')
-    plt.close()
-    
 
-    
-def wind_profile_aerosol_backscatter_last24(wp_yesterday_file, wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def stream_time_series(files, variables, height_variable, nbins, start = None, binning = None, max_memory = 256 * 2**20,
+                       dataset_cache = None, only_good_data = False, end = None, keep_unfiltered = False):
     """
-    Create plot of aerosol backscatter from Wind Profile data for last 24 hours
+    Like load_time_series, but aggregating the records into nbins evenly
+    spaced bins of time as they are read, a few at a time, so that no
+    more than about max_memory bytes of records are held at once however
+    long the files are. binning is {variable: 'mean', 'log-mean' or
+    'max'} as for bin_grid, 'mean' by default. The TimeSeries has the bin
+    centres as its times, and NaN in bins without good data. If there are
+    no more records than bins they are read as they are. Each file is
+    closed in dataset_cache once it has been read.
     """
-    wp_yesterday_dataset = Dataset(wp_yesterday_file)
-    wp_today_dataset = Dataset(wp_today_file)
-    
-    current_time = dt.datetime.strptime("2022-06-07T17:54:48 +00:00","%Y-%m-%dT%H:%M:%S %z")
-    time_minus_24 = current_time - dt.timedelta(days=1)
-    time_minus_24_timestamp = time_minus_24.timestamp()
-    
-    y_locs = np.where(wp_yesterday_dataset['time'][:] > time_minus_24_timestamp)[0]
-    
-    y_times = wp_yesterday_dataset['time'][:][y_locs]
-    t_times = wp_today_dataset['time'][:]
-    times = np.hstack((y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
+    binning = binning or {}
+    with use_dataset_cache(dataset_cache) as cache:
+        # times are small enough to read whole, and give the bins
+        file_times = []
+        firsts = []
+        for f in files:
+            times = np.ma.getdata(cache.variable(f, 'time'))
+            firsts.append(0 if start is None else first_record_after(times, start))
+            # records after end are left out as if they were not there
+            file_times.append(times if end is None else times[:max(firsts[-1], first_record_after(times, end))])
+        in_window = [ times[first:] for times, first in zip(file_times, firsts) if len(times) > first ]
+        if not in_window:
+            raise ValueError(f'No records in {files} between {start} and {end}')
+        if sum(len(times) for times in in_window) <= nbins:
+            return load_time_series(files, variables, height_variable, start, cache, only_good_data, end = end, keep_unfiltered = keep_unfiltered)
+        edges = np.linspace(in_window[0][0], in_window[-1][-1], nbins + 1)
+        heights, units = _heights_and_units(cache, files[-1], variables, height_variable)
         
-    
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
-    
-    if only_good_data:
-        data_y = np.ma.masked_where(wp_yesterday_dataset['qc_flag_backscatter'][y_locs,:,:] > 1, wp_yesterday_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:])
-        data_t = np.ma.masked_where(wp_today_dataset['qc_flag_backscatter'][:] > 1, wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data = np.ma.vstack((data_y,data_t))
+        # {variable: (totals, counts)} of each bin, and the same for the
+        # values from before bad data was set to NaN if they are kept
+        binned = {}
+        binned_unfiltered = {}
+        for name in variables:
+            ngates = cache.dataset(files[0])[name].shape[1]
+            binned[name] = _empty_bins(nbins, ngates, binning.get(name, 'mean'))
+            if keep_unfiltered and only_good_data and name in QC_FLAGS:
+                binned_unfiltered[name] = _empty_bins(nbins, ngates, binning.get(name, 'mean'))
+        for f, times, first in zip(files, file_times, firsts):
+            for name, (totals, counts) in binned.items():
+                keep = name in binned_unfiltered
+                chunk = max(1, max_memory // (totals.shape[1] * (_STREAM_BYTES_PER_VALUE + 4 * keep)))
+                for chunk_start in range(first, len(times), chunk):
+                    records = slice(chunk_start, min(chunk_start + chunk, len(times)))
+                    values = np.empty((records.stop - records.start, totals.shape[1]), dtype = np.float32)
+                    unfiltered = np.empty_like(values) if keep else None
+                    with phase('read', file = f, variable = name, bytes = values.nbytes * (2 if keep else 1)):
+                        _read_values(values, cache, f, name, records, only_good_data, unfiltered)
+                    with phase('bin', records = len(values)):
+                        bins = np.searchsorted(edges, times[records], side = 'right') - 1
+                        _accumulate_bins(bins, values, totals, counts, binning.get(name, 'mean'))
+                        if keep:
+                            _accumulate_bins(bins, unfiltered, *binned_unfiltered[name], binning.get(name, 'mean'))
+                    del values, unfiltered
+            # so that open files' HDF5 caches do not add up either
+            cache.evict(f)
+            
+        data = { name: _binned_values(totals, counts, binning.get(name, 'mean')) for name, (totals, counts) in binned.items() }
+        unfiltered = { name: _binned_values(totals, counts, binning.get(name, 'mean')) for name, (totals, counts) in binned_unfiltered.items() }
+        return TimeSeries((edges[:-1] + edges[1:]) / 2, heights, data, units, [0], unfiltered)
+        
+        
+        
+def _empty_bins(nbins, ngates, binning):
+    """
+    (totals, counts) for _accumulate_bins to add nbins bins of ngates to.
+    """
+    return (np.full((nbins, ngates), -np.inf) if binning == 'max' else np.zeros((nbins, ngates)),
+            np.zeros((nbins, ngates), dtype = np.int64))
+            
+            
+            
+def _binned_values(totals, counts, binning):
+    """
+    float32 value of each bin from what _accumulate_bins added up, NaN
+    where nothing was.
+    """
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        if binning == 'max':
+            values = totals
+        elif binning == 'log-mean':
+            values = 10**(totals / counts)
+        else:
+            values = totals / counts
+    return np.where(counts > 0, values, np.nan).astype(np.float32)
+        
+        
+        
+def _accumulate_bins(bins, values, totals, counts, binning):
+    """
+    Add values, one row per record, into the rows bins (sorted) of totals
+    and counts. totals holds sums of the values, or of their log10 for
+    'log-mean', or their maximum for 'max'.
+    """
+    bins = np.clip(bins, 0, len(totals) - 1)
+    valid = np.isfinite(values)
+    if binning == 'log-mean':
+        valid &= values > 0
+        values = np.log10(np.where(valid, values, 1))
+    elif binning == 'max':
+        values = np.where(valid, values, -np.inf)
     else:
-        data_y = wp_yesterday_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:]
-        data_t = wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data = np.vstack((data_y,data_t))
+        values = np.where(valid, values, 0)
         
-    c = ax.pcolormesh(x,wp_today_dataset['range'][0,:,0],data[:,:,0].T,norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
-    
-    set_major_minor_date_ticks(ax)
-
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
-    
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {wp_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
-
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
-    
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_last24_qc.png')
+    # each bin's records are contiguous, so can be reduced in one go
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    rows = bins[starts]
+    if binning == 'max':
+        totals[rows] = np.maximum(totals[rows], np.maximum.reduceat(values, starts, axis = 0))
     else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_last24.png')
-    plt.close()
+        totals[rows] += np.add.reduceat(values, starts, axis = 0)
+    counts[rows] += np.add.reduceat(valid, starts, axis = 0, dtype = np.int64)
     
     
     
-def wind_profile_mean_winds_speed_direction_last24(meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = 5):
+def output_filename(output_location, product, plot, window, only_good_data = False):
     """
-    Create plot of wind speed and direction from Wind Profile data for last 24 hours
+    Where to save plot ('aerosol-backscatter', 'speed-direction' or
+    'upward-velocity') of product ('stare', 'wind-profile' or
+    'mean-winds') for window.
     """
-    meanwind_yesterday_dataset = Dataset(meanwind_yesterday_file)
-    meanwind_today_dataset = Dataset(meanwind_today_file)
-    
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_24 = current_time - dt.timedelta(days=1)
-    time_minus_24_timestamp = time_minus_24.timestamp()
+    if product == 'mean-winds':
+        product = 'wind-profile_mean-winds'
+    qc = '_qc' if only_good_data else ''
+    return f'{output_location}/plot_ncas-lidar-dop-2_{product}_{plot}_{window}{qc}.png'
     
-    y_locs = np.where(meanwind_yesterday_dataset['time'][:] > time_minus_24_timestamp)[0]
     
-    y_times = meanwind_yesterday_dataset['time'][:][y_locs]
-    t_times = meanwind_today_dataset['time'][:]
-    times = np.hstack((y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
     
-    u_y = meanwind_today_dataset['eastward_wind'][y_locs]
-    u_t = meanwind_today_dataset['eastward_wind'][:]
-    u = np.vstack((u_y,u_t))
+"""
+Drawing plots
+"""
+
+def is_regular(coords, tolerance = 0.1):
+    """
+    Whether coords are increasing and evenly spaced, with none more than
+    tolerance of a step away from where an even spacing puts it.
+    """
+    if len(coords) < 2:
+        return False
+    coords = np.ma.getdata(coords)
+    step = (coords[-1] - coords[0]) / (len(coords) - 1)
+    if not step > 0:
+        return False
+    return np.abs(coords - np.linspace(coords[0], coords[-1], len(coords))).max() <= tolerance * step
     
-    v_y = meanwind_today_dataset['northward_wind'][y_locs]
-    v_t = meanwind_today_dataset['northward_wind'][:]
-    v = np.vstack((v_y,v_t))
     
-    ws_y = meanwind_today_dataset['wind_speed'][y_locs]
-    ws_t = meanwind_today_dataset['wind_speed'][:]
-    ws = np.vstack((ws_y,ws_t))
     
-    y = meanwind_today_dataset['altitude'][:]
+def _bin_axis(coords, values, counts, nbins, axis, binning):
+    """
+    Aggregate values, with counts of the cells behind each, into nbins
+    evenly spaced bins of sorted coords along axis. Returns bin centres,
+    binned values and binned counts.
+    """
+    coords = np.ma.getdata(coords)
+    if nbins is None or len(coords) <= nbins:
+        return coords, values, counts
+    edges = np.linspace(coords[0], coords[-1], nbins + 1)
+    starts = np.searchsorted(coords, edges[:-1])
+    empty = np.diff(np.append(starts, len(coords))) == 0
+    
+    if binning == 'max':
+        binned = np.maximum.reduceat(np.where(counts > 0, values, -np.inf), starts, axis = axis)
+    else:
+        # a bin of the axis binned before with nothing in it holds NaN, which would spoil its whole bin here
+        binned = np.add.reduceat(np.where(counts > 0, values * counts, 0), starts, axis = axis)
+    binned_counts = np.add.reduceat(counts, starts, axis = axis)
+    # reduceat gives the value at the start of the next bin for empty bins
+    index = [slice(None)] * values.ndim
+    index[axis] = empty
+    binned_counts[tuple(index)] = 0
+    if binning != 'max':
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            binned = binned / binned_counts
+            
+    return (edges[:-1] + edges[1:]) / 2, binned, binned_counts
+    
+    
+    
+def bin_grid(x, y, data, nx, ny = None, binning = 'mean'):
+    """
+    Aggregate data, shaped (y, x), into nx evenly spaced bins of x, and ny
+    of y if given, so no more cells are drawn than there are pixels to
+    show them. binning is 'mean', 'log-mean' (the mean of log10, for
+    quantities spanning orders of magnitude such as backscatter) or
+    'max'. Masked cells are left out, and a bin with no unmasked cells is
+    masked. An axis already no longer than its bins is left as it is.
+    Returns binned x, y and data.
+    """
+    values = np.ma.getdata(data).astype(np.float32, copy = False)
+    valid = ~np.ma.getmaskarray(data) & np.isfinite(values)
+    if binning == 'log-mean':
+        valid &= values > 0
+        values = np.log10(np.where(valid, values, 1))
+    else:
+        values = np.where(valid, values, 0)
+    counts = valid.astype(np.float32)
     
-    x,y = np.meshgrid(x,y)
+    x, values, counts = _bin_axis(x, values, counts, nx, 1, binning)
+    y, values, counts = _bin_axis(y, values, counts, ny, 0, binning)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
+    if binning == 'log-mean':
+        values = 10**values
+    return x, y, np.ma.masked_array(values, mask = counts == 0)
     
-    pc = ax.pcolormesh(x,y,ws.T)
     
-    set_major_minor_date_ticks(ax)
     
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
-    ax.grid(which='both')
+def draw_grid(ax, x, y, data, bin_to_pixels = None, binning = 'mean', **kwargs):
+    """
+    Draw data, shaped (y, x), with each cell centred on its x and y like
+    pcolormesh. On a regular grid the cells are drawn as one image, which
+    is much faster than a mesh with a polygon per cell. Gaps or uneven
+    spacing fall back to pcolormesh.
+    
+    bin_to_pixels, 'time' or 'time-height', first aggregates the data to
+    the pixels of ax along those axes using bin_grid and binning, so the
+    cost of drawing does not grow with the amount of data.
+    """
+    if bin_to_pixels is not None:
+        nx = int(ax.bbox.width)
+        ny = int(ax.bbox.height) if bin_to_pixels == 'time-height' else None
+        x, y, data = bin_grid(x, y, data, nx, ny, binning)
+        
+    if is_regular(x) and is_regular(y):
+        dx = (x[-1] - x[0]) / (len(x) - 1)
+        dy = (y[-1] - y[0]) / (len(y) - 1)
+        extent = (x[0] - dx/2, x[-1] + dx/2, y[0] - dy/2, y[-1] + dy/2)
+        return ax.imshow(data, origin = 'lower', extent = extent, aspect = 'auto', interpolation = 'nearest', **kwargs)
+    return ax.pcolormesh(x, y, data, **kwargs)
     
-    cbar = fig.colorbar(pc, ax = ax)
-    cbar.ax.set_ylabel('Wind speed (m s-1)')
-    ax.barbs(x[::barb_interval,::barb_interval], y[::barb_interval,::barb_interval], u[::barb_interval,::barb_interval].T, v[::barb_interval,::barb_interval].T, length = 7)
     
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_speed-direction_last24.png')
-    plt.close()
+@lru_cache(maxsize = None)
+def plot_width_pixels():
+    """
+    Width in pixels of the data area of the plots, all being the same size.
+    """
+    return int(PlotTemplate('', None).ax.bbox.width)
     
     
     
-def wind_profile_mean_winds_upward_velocity_last24(meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png'):
+@lru_cache(maxsize = None)
+def read_logo(image_file):
     """
-    Create plot of upward air velocity from Wind Profile data
+    Decoded logo image, read from disk once however many plots use it.
     """
-    meanwind_yesterday_dataset = Dataset(meanwind_yesterday_file)
-    meanwind_today_dataset = Dataset(meanwind_today_file)
+    import matplotlib.image as image
+    return image.imread(image_file)
     
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_24 = current_time - dt.timedelta(days=1)
-    time_minus_24_timestamp = time_minus_24.timestamp()
     
-    y_locs = np.where(meanwind_yesterday_dataset['time'][:] > time_minus_24_timestamp)[0]
     
-    y_times = meanwind_yesterday_dataset['time'][:][y_locs]
-    t_times = meanwind_today_dataset['time'][:]
-    times = np.hstack((y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
-    
-    y = meanwind_today_dataset['altitude'][:]
+# image format: file name extension
+IMAGE_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+
+class ImageWriter:
+    """
+    Writes out drawn figures. Each figure is rendered once, and from its
+    pixels are written a PNG with zlib compression level png_compression
+    (0-9), a PNG thumbnail thumbnail_width pixels wide if given, and a
+    copy in each of image_formats (see IMAGE_EXTENSIONS), named after the
+    PNG.
+    
+    If background is True the images are encoded in a thread, so that
+    the next plot can be drawn meanwhile, and write() returns before they
+    are written: each call adds a future to pending, which gives
+    (seconds, bytes) once its images are written. Call close() to wait
+    for the last of them.
+    """
+    def __init__(self, png_compression = 6, thumbnail_width = None, image_formats = (), background = False):
+        self.png_compression = png_compression
+        self.thumbnail_width = thumbnail_width
+        self.image_formats = image_formats
+        self.pending = []
+        self._executor = ThreadPoolExecutor(max_workers = 1) if background else None
+        
+    def output_files(self, output_file):
+        """
+        Every file written for the PNG output_file.
+        """
+        stem = os.path.splitext(output_file)[0]
+        files = [output_file]
+        if self.thumbnail_width is not None:
+            files.append(f'{stem}_thumbnail.png')
+        return files + [ f'{stem}.{IMAGE_EXTENSIONS[image_format]}' for image_format in self.image_formats ]
+        
+    def write(self, fig, output_file):
+        """
+        Render fig, which has an Agg canvas, and write its images for the
+        PNG output_file.
+        """
+        with phase('render'):
+            fig.canvas.draw()
+            # copied, as the canvas is drawn over by the next plot
+            pixels = np.array(fig.canvas.buffer_rgba())
+        if self._executor is not None:
+            self.pending.append(self._executor.submit(self._encode, pixels, output_file, fig.dpi))
+            return
+        with phase('encode') as sizes:
+            sizes['bytes'] = self._encode(pixels, output_file, fig.dpi)[1]
+            
+    def _encode(self, pixels, output_file, dpi):
+        from matplotlib.image import imsave
+        from PIL import Image
+        start = time.perf_counter()
+        files = self.output_files(output_file)
+        # as savefig would write it
+        imsave(output_file, pixels, format = 'png', dpi = dpi, pil_kwargs = {'compress_level': self.png_compression})
+        if self.thumbnail_width is not None:
+            height = max(1, round(pixels.shape[0] * self.thumbnail_width / pixels.shape[1]))
+            thumbnail = Image.fromarray(pixels).resize((self.thumbnail_width, height), Image.LANCZOS)
+            thumbnail.save(files[1], compress_level = self.png_compression)
+        for image_format, filename in zip(self.image_formats, files[len(files) - len(self.image_formats):]):
+            imsave(filename, pixels, format = image_format, dpi = dpi)
+        return time.perf_counter() - start, sum(os.path.getsize(f) for f in files)
+        
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            
+            
+            
+class PlotTemplate:
+    """
+    Figure, axes, date ticks, colourbar and logo for one kind of plot.
     
-    w_y = meanwind_today_dataset['upward_air_velocity'][y_locs]
-    w_t = meanwind_today_dataset['upward_air_velocity'][:]
-    w = np.vstack((w_y,w_t))
+    Built the first time that kind of plot is made and then kept, so each
+    later plot only swaps in its own data before saving. draw_kwargs,
+    e.g. norm or cmap, are passed to draw_grid for every plot.
+    """
+    _templates = {}
+    
+    def __init__(self, xlabel, image_file, **draw_kwargs):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.figure import Figure
+        self.draw_kwargs = draw_kwargs
+        self.fig = Figure(figsize=(20,8))
+        FigureCanvasAgg(self.fig)
+        self.fig.set_facecolor('white')
+        self.ax = self.fig.add_subplot(111)
+        
+        set_major_minor_date_ticks(self.ax)
+        
+        self.ax.grid(which='both')
+        self.ax.set_ylabel('Altitude (m)')
+        self.ax.set_xlabel(xlabel)
+        
+        self.mappable = None
+        self.overlays = []
+        placeholder = ScalarMappable(norm = draw_kwargs.get('norm'), cmap = draw_kwargs.get('cmap'))
+        placeholder.set_clim(draw_kwargs.get('vmin'), draw_kwargs.get('vmax'))
+        self.cbar = self.fig.colorbar(placeholder, ax = self.ax)
+        
+        if image_file is not None:
+            newax = self.fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
+            newax.imshow(read_logo(image_file))
+            newax.axis('off')
+        
+    @classmethod
+    @contextmanager
+    def reuse(cls, key, *args, **kwargs):
+        """
+        Yield the template for key, building it from args the first time.
+        A template is thrown away if a plot using it fails, in case that
+        left it half drawn.
+        """
+        if key not in cls._templates:
+            cls._templates[key] = cls(*args, **kwargs)
+        try:
+            yield cls._templates[key]
+        except Exception:
+            cls._templates.pop(key, None)
+            raise
+            
+    def draw(self, x, y, data, colorbar_label, bin_to_pixels = None, binning = 'mean'):
+        """
+        Replace the data drawn, and anything added with add_overlay, by
+        data on x and y as drawn by draw_grid.
+        """
+        if self.mappable is not None:
+            self.mappable.remove()
+        for artist in self.overlays:
+            artist.remove()
+        self.overlays = []
+        
+        from matplotlib.image import AxesImage
+        with phase('draw', shape = data.shape):
+            self.mappable = draw_grid(self.ax, x, y, data, bin_to_pixels, binning, **self.draw_kwargs)
+        if isinstance(self.mappable, AxesImage):
+            x0, x1, y0, y1 = self.mappable.get_extent()
+        else:
+            (x0, y0), (x1, y1) = self.mappable.get_datalim(self.ax.transData).get_points()
+        self.ax.set_xlim(x0, x1)
+        self.ax.set_ylim(y0, y1)
+        # date numbers are in days, so whole numbers are midnights
+        set_major_minor_date_ticks(self.ax, minor_tick_hours(x1 - x0), np.floor(x1) >= x0)
+        
+        self.cbar.update_normal(self.mappable)
+        self.cbar.ax.set_ylabel(colorbar_label)
+        
+    def add_overlay(self, artist):
+        self.overlays.append(artist)
+        
+    def save(self, output_file, image_writer = None):
+        """
+        Write the figure to output_file with image_writer, an ImageWriter,
+        or by default as a PNG written straight away.
+        """
+        (image_writer or ImageWriter()).write(self.fig, output_file)
+        
+        
+        
+def plot_aerosol_backscatter(series, output_file, image_file = 'NCAS_national_centre_logo_transparent-768x184.png', bin_to_pixels = None, backscatter_binning = 'log-mean', vmin = 10**-7, vmax = 10**-3,
+                             unfiltered_output_file = None, image_writer = None):
+    """
+    Create plot of aerosol backscatter from Stare or Wind Profile TimeSeries,
+    coloured on a log scale from vmin to vmax. Bad data is left out if
+    series was read with only_good_data. bin_to_pixels and
+    backscatter_binning are passed on to draw_grid. If
+    unfiltered_output_file is given, the plot with bad data left in, from
+    series.unfiltered, is also saved there from the same figure, so series
+    must have been read with keep_unfiltered. The images are written with
+    image_writer, an ImageWriter, if given.
+    """
+    from matplotlib.colors import LogNorm
+    x = time_to_mdates(series.times)
+    
+    name = 'attenuated_aerosol_backscatter_coefficient'
+    data = series[name]
+    outputs = [(output_file, data)]
+    if unfiltered_output_file is not None:
+        if name not in series.unfiltered:
+            raise ValueError(f'{unfiltered_output_file} needs {name} read with keep_unfiltered, so that its bad data is kept')
+        outputs.append((unfiltered_output_file, series.unfiltered[name]))
+        
+    with PlotTemplate.reuse(('aerosol-backscatter', image_file, vmin, vmax), 'Time (UTC)', image_file, norm = LogNorm(vmin = vmin, vmax = vmax)) as template:
+        for output, values in outputs:
+            template.draw(x, series.heights, values.T, f"Attenuated aerosol backscatter coefficient {series.units[name]}",
+                          bin_to_pixels, backscatter_binning)
+            template.save(output, image_writer)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    c = ax.pcolormesh(x,y,w.T, cmap='RdBu_r', vmin = -5, vmax = 5)
     
-    set_major_minor_date_ticks(ax)
+def plot_mean_winds_speed_direction(series, output_file, image_file = 'logo--white_43f4c135.png', barb_interval = None, bin_to_pixels = None, barb_spacing = 40,
+                                    image_writer = None):
+    """
+    Create plot of wind speed and direction from mean winds TimeSeries.
+    bin_to_pixels is passed on to draw_grid. The image is written with
+    image_writer, an ImageWriter, if given.
+    
+    Wind barbs are drawn on a grid barb_spacing pixels apart, each showing
+    the vector mean of the winds in its cell, so there are as many however
+    long the series is or however often it was recorded. If barb_interval
+    is given, a barb is instead drawn at every barb_interval-th time and
+    height.
+    """
+    u = series['eastward_wind']
+    v = series['northward_wind']
+    
+    y = series.heights
+    x = time_to_mdates(series.times)
+    
+    with PlotTemplate.reuse(('speed-direction', image_file), 'Time', image_file) as template:
+        template.draw(x, y, series['wind_speed'].T, 'Wind speed (m s-1)', bin_to_pixels)
+        if barb_interval is None:
+            nx = max(1, int(template.ax.bbox.width / barb_spacing))
+            ny = max(1, int(template.ax.bbox.height / barb_spacing))
+            barb_x, barb_y, barb_u = bin_grid(x, y, u.T, nx, ny)
+            _, _, barb_v = bin_grid(x, y, v.T, nx, ny)
+            missing = np.ma.getmaskarray(barb_u) | np.ma.getmaskarray(barb_v)
+            barb_u, barb_v = np.ma.masked_array(barb_u, mask = missing), np.ma.masked_array(barb_v, mask = missing)
+        else:
+            barb_x, barb_y = x[::barb_interval], y[::barb_interval]
+            barb_u, barb_v = u[::barb_interval,::barb_interval].T, v[::barb_interval,::barb_interval].T
+        with phase('barbs', shape = barb_u.shape):
+            template.add_overlay(template.ax.barbs(barb_x, barb_y, barb_u, barb_v, length = 7))
+        template.save(output_file, image_writer)
+    
+    
+    
+def plot_mean_winds_upward_velocity(series, output_file, image_file = 'NCAS_national_centre_logo_transparent-768x184.png', bin_to_pixels = None, vmin = -5, vmax = 5,
+                                    image_writer = None):
+    """
+    Create plot of upward air velocity from mean winds TimeSeries, coloured
+    from vmin to vmax.
+    bin_to_pixels is passed on to draw_grid. The image is written with
+    image_writer, an ImageWriter, if given.
+    """
+    y = series.heights
+    x = time_to_mdates(series.times)
     
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
+    with PlotTemplate.reuse(('upward-velocity', image_file, vmin, vmax), 'Time', image_file, cmap='RdBu_r', vmin = vmin, vmax = vmax) as template:
+        template.draw(x, y, series['upward_air_velocity'].T, f"Upward air velocity {series.units['upward_air_velocity']}", bin_to_pixels)
+        template.save(output_file, image_writer)
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Upward air velocity {meanwind_today_dataset['upward_air_velocity'].units}")
     
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_upward-velocity_last24.png')
-    plt.close()
-
-
 """
-Plots for last 48 hours
+Plots for today's data
 """
 
-def stare_aerosol_backscatter_last48(stare_daybeforeyesterday_file, stare_yesterday_file, stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def stare_aerosol_backscatter_today(stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, dataset_cache = None, also_unfiltered = False):
     """
-    Create plot of aerosol backscatter from Stare data for last 24 hours
+    Create plot of aerosol backscatter from Stare data
+    
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the file.
     """
-    stare_dby_dataset = Dataset(stare_daybeforeyesterday_file)
-    stare_yesterady_dataset = Dataset(stare_yesterday_file)
-    stare_today_dataset = Dataset(stare_today_file)
+    series = load_time_series([stare_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', dataset_cache = dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'stare', 'aerosol-backscatter', 'today', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'stare', 'aerosol-backscatter', 'today') if also_unfiltered and only_good_data else None)
     
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_48 = current_time - dt.timedelta(days=2)
-    time_minus_48_timestamp = time_minus_48.timestamp()
     
-    y_locs = np.where(stare_dby_dataset['time'][:] > time_minus_48_timestamp)[0]
     
-    dby_times = stare_dby_dataset['time'][:][y_locs]
-    y_times = stare_yesterady_dataset['time'][:]
-    t_times = stare_today_dataset['time'][:]
-    times = np.hstack((dby_times, y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
-        
+def wind_profile_aerosol_backscatter_today(wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, dataset_cache = None, also_unfiltered = False):
+    """
+    Create plot of aerosol backscatter from Wind Profile data
+    
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the file.
+    """
+    series = load_time_series([wp_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', dataset_cache = dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'today', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'today') if also_unfiltered and only_good_data else None)
+    
+    
+    
+def wind_profile_mean_winds_speed_direction_today(meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = None, dataset_cache = None):
+    """
+    Create plot of wind speed and direction from Wind Profile data
+    """
+    series = load_time_series([meanwind_today_file], ['eastward_wind', 'northward_wind', 'wind_speed'], 'altitude', dataset_cache = dataset_cache)
+    plot_mean_winds_speed_direction(series, output_filename(output_location, 'mean-winds', 'speed-direction', 'today'), image_file = image_file, barb_interval = barb_interval)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    if only_good_data:
-        data_dby = np.ma.masked_where(stare_dby_dataset['qc_flag_backscatter'][y_locs,:,:] > 1, stare_dby_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:])
-        data_y = np.ma.masked_where(stare_yesterady_dataset['qc_flag_backscatter'][:] > 1, stare_yesterady_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data_t = np.ma.masked_where(stare_today_dataset['qc_flag_backscatter'][:] > 1, stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data = np.ma.vstack((data_dby,data_y,data_t))
-    else:
-        data_dby = stare_dby_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:]
-        data_y = stare_yesterady_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data_t = stare_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data = np.vstack((data_dby,data_y,data_t))
-        
-    c = ax.pcolormesh(x,stare_today_dataset['range'][0,:,0],data[:,:,0].T,norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
     
-    set_major_minor_date_ticks(ax)
+def wind_profile_mean_winds_upward_velocity_today(meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', dataset_cache = None):
+    """
+    Create plot of upward air velocity from Wind Profile data
+    """
+    series = load_time_series([meanwind_today_file], ['upward_air_velocity'], 'altitude', dataset_cache = dataset_cache)
+    plot_mean_winds_upward_velocity(series, output_filename(output_location, 'mean-winds', 'upward-velocity', 'today'), image_file = image_file)
 
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {stare_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
+"""
+Plots for last 24 hours
+"""
 
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
+def stare_aerosol_backscatter_last24(stare_yesterday_file, stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, reference_time = None, dataset_cache = None, also_unfiltered = False):
+    """
+    Create plot of aerosol backscatter from Stare data for last 24 hours
     
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_last48_qc.png')
-    else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_stare_aerosol-backscatter_last48.png')
-    plt.close()
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the files.
+    """
+    series = load_time_series([stare_yesterday_file, stare_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', window_start('last24', reference_time), dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'stare', 'aerosol-backscatter', 'last24', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'stare', 'aerosol-backscatter', 'last24') if also_unfiltered and only_good_data else None)
     
 
     
-def wind_profile_aerosol_backscatter_last48(wp_daybeforeyesterday_file, wp_yesterday_file, wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True):
+def wind_profile_aerosol_backscatter_last24(wp_yesterday_file, wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, reference_time = None, dataset_cache = None, also_unfiltered = False):
     """
     Create plot of aerosol backscatter from Wind Profile data for last 24 hours
+    
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the files.
     """
-    wp_dby_dataset = Dataset(wp_daybeforeyesterday_file)
-    wp_yesterday_dataset = Dataset(wp_yesterday_file)
-    wp_today_dataset = Dataset(wp_today_file)
+    series = load_time_series([wp_yesterday_file, wp_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', window_start('last24', reference_time), dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'last24', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'last24') if also_unfiltered and only_good_data else None)
     
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_48 = current_time - dt.timedelta(days=2)
-    time_minus_48_timestamp = time_minus_48.timestamp()
     
-    y_locs = np.where(wp_dby_dataset['time'][:] > time_minus_48_timestamp)[0]
     
-    dby_times = wp_dby_dataset['time'][:][y_locs]
-    y_times = wp_yesterday_dataset['time'][:]
-    t_times = wp_today_dataset['time'][:]
-    times = np.hstack((dby_times, y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
-        
+def wind_profile_mean_winds_speed_direction_last24(meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = None, reference_time = None, dataset_cache = None):
+    """
+    Create plot of wind speed and direction from Wind Profile data for last 24 hours
+    """
+    series = load_time_series([meanwind_yesterday_file, meanwind_today_file], ['eastward_wind', 'northward_wind', 'wind_speed'], 'altitude', window_start('last24', reference_time), dataset_cache)
+    plot_mean_winds_speed_direction(series, output_filename(output_location, 'mean-winds', 'speed-direction', 'last24'), image_file = image_file, barb_interval = barb_interval)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
     
-    if only_good_data:
-        data_dby = np.ma.masked_where(wp_dby_dataset['qc_flag_backscatter'][y_locs,:,:] > 1, wp_dby_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:])
-        data_y = np.ma.masked_where(wp_yesterday_dataset['qc_flag_backscatter'][:] > 1, wp_yesterday_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data_t = np.ma.masked_where(wp_today_dataset['qc_flag_backscatter'][:] > 1, wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:])
-        data = np.ma.vstack((data_dby,data_y,data_t))
-    else:
-        data_dby = wp_dby_dataset['attenuated_aerosol_backscatter_coefficient'][y_locs,:,:]
-        data_y = wp_yesterday_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data_t = wp_today_dataset['attenuated_aerosol_backscatter_coefficient'][:]
-        data = np.vstack((data_dby,data_y,data_t))
-        
-    c = ax.pcolormesh(x,wp_today_dataset['range'][0,:,0],data[:,:,0].T,norm = LogNorm(vmin=(10**-7),vmax=(10**-3)))
     
-    set_major_minor_date_ticks(ax)
+def wind_profile_mean_winds_upward_velocity_last24(meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', reference_time = None, dataset_cache = None):
+    """
+    Create plot of upward air velocity from Wind Profile data
+    """
+    series = load_time_series([meanwind_yesterday_file, meanwind_today_file], ['upward_air_velocity'], 'altitude', window_start('last24', reference_time), dataset_cache)
+    plot_mean_winds_upward_velocity(series, output_filename(output_location, 'mean-winds', 'upward-velocity', 'last24'), image_file = image_file)
 
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time (UTC)')
+
+"""
+Plots for last 48 hours
+"""
+
+def stare_aerosol_backscatter_last48(stare_daybeforeyesterday_file, stare_yesterday_file, stare_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, reference_time = None, dataset_cache = None, also_unfiltered = False):
+    """
+    Create plot of aerosol backscatter from Stare data for last 24 hours
+    
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the files.
+    """
+    series = load_time_series([stare_daybeforeyesterday_file, stare_yesterday_file, stare_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', window_start('last48', reference_time), dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'stare', 'aerosol-backscatter', 'last48', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'stare', 'aerosol-backscatter', 'last48') if also_unfiltered and only_good_data else None)
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Attenuated aerosol backscatter coefficient {wp_today_dataset['attenuated_aerosol_backscatter_coefficient'].units}")
 
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    if only_good_data:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_last48_qc.png')
-    else:
-        plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_aerosol-backscatter_last48.png')
-    plt.close()
+def wind_profile_aerosol_backscatter_last48(wp_daybeforeyesterday_file, wp_yesterday_file, wp_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', only_good_data = True, reference_time = None, dataset_cache = None, also_unfiltered = False):
+    """
+    Create plot of aerosol backscatter from Wind Profile data for last 24 hours
     
+    If also_unfiltered, the plot with bad data left in is also made from
+    the same read of the files.
+    """
+    series = load_time_series([wp_daybeforeyesterday_file, wp_yesterday_file, wp_today_file], ['attenuated_aerosol_backscatter_coefficient'], 'range', window_start('last48', reference_time), dataset_cache, only_good_data = only_good_data, keep_unfiltered = also_unfiltered)
+    plot_aerosol_backscatter(series, output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'last48', only_good_data), image_file = image_file,
+                             unfiltered_output_file = output_filename(output_location, 'wind-profile', 'aerosol-backscatter', 'last48') if also_unfiltered and only_good_data else None)
     
     
-def wind_profile_mean_winds_speed_direction_last48(meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = 5):
+    
+def wind_profile_mean_winds_speed_direction_last48(meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'logo--white_43f4c135.png', barb_interval = None, reference_time = None, dataset_cache = None):
     """
     Create plot of wind speed and direction from Wind Profile data for last 24 hours
     """
-    meanwind_dby_dataset = Dataset(meanwind_daybeforeyesterday_file)
-    meanwind_yesterday_dataset = Dataset(meanwind_yesterday_file)
-    meanwind_today_dataset = Dataset(meanwind_today_file)
+    series = load_time_series([meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file], ['eastward_wind', 'northward_wind', 'wind_speed'], 'altitude', window_start('last48', reference_time), dataset_cache)
+    plot_mean_winds_speed_direction(series, output_filename(output_location, 'mean-winds', 'speed-direction', 'last48'), image_file = image_file, barb_interval = barb_interval)
     
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_48 = current_time - dt.timedelta(days=2)
-    time_minus_48_timestamp = time_minus_48.timestamp()
     
-    y_locs = np.where(meanwind_dby_dataset['time'][:] > time_minus_48_timestamp)[0]
     
-    dby_times = meanwind_dby_dataset['time'][:][y_locs]
-    y_times = meanwind_yesterday_dataset['time'][:]
-    t_times = meanwind_today_dataset['time'][:]
-    times = np.hstack((dby_times, y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
+def wind_profile_mean_winds_upward_velocity_last48(meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png', reference_time = None, dataset_cache = None):
+    """
+    Create plot of upward air velocity from Wind Profile data
+    """
+    series = load_time_series([meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file], ['upward_air_velocity'], 'altitude', window_start('last48', reference_time), dataset_cache)
+    plot_mean_winds_upward_velocity(series, output_filename(output_location, 'mean-winds', 'upward-velocity', 'last48'), image_file = image_file)
+
+
+
+"""
+Running the plots from the command line
+"""
+
+# command line option: (product, window, plot)
+PLOT_OPTIONS = {
+    'stare_aerosol_backscatter_today': ('stare', 'today', 'aerosol-backscatter'),
+    'stare_aerosol_backscatter_last24': ('stare', 'last24', 'aerosol-backscatter'),
+    'stare_aerosol_backscatter_last48': ('stare', 'last48', 'aerosol-backscatter'),
+    'wp_aerosol_backscatter_today': ('wind-profile', 'today', 'aerosol-backscatter'),
+    'wp_aerosol_backscatter_last24': ('wind-profile', 'last24', 'aerosol-backscatter'),
+    'wp_aerosol_backscatter_last48': ('wind-profile', 'last48', 'aerosol-backscatter'),
+    'speed_direction_today': ('mean-winds', 'today', 'speed-direction'),
+    'speed_direction_last24': ('mean-winds', 'last24', 'speed-direction'),
+    'speed_direction_last48': ('mean-winds', 'last48', 'speed-direction'),
+    'vertical_velocity_today': ('mean-winds', 'today', 'upward-velocity'),
+    'vertical_velocity_last24': ('mean-winds', 'last24', 'upward-velocity'),
+    'vertical_velocity_last48': ('mean-winds', 'last48', 'upward-velocity'),
+}
+
+# product: variable giving the height of each gate
+PRODUCT_HEIGHTS = {'stare': 'range', 'wind-profile': 'range', 'mean-winds': 'altitude'}
+
+# plot: (function to draw it, variables it uses)
+PLOTS = {
+    'aerosol-backscatter': (plot_aerosol_backscatter, ['attenuated_aerosol_backscatter_coefficient']),
+    'speed-direction': (plot_mean_winds_speed_direction, ['eastward_wind', 'northward_wind', 'wind_speed']),
+    'upward-velocity': (plot_mean_winds_upward_velocity, ['upward_air_velocity']),
+}
+
+
+
+def plot_option(option):
+    """
+    (product, window, plot) of command line option: one of PLOT_OPTIONS,
+    or a plot of those for another window (see window_length), named
+    like them, e.g. 'stare_aerosol_backscatter_last7d'.
+    """
+    if option in PLOT_OPTIONS:
+        return PLOT_OPTIONS[option]
+    name, _, window = option.rpartition('_')
+    if f'{name}_today' not in PLOT_OPTIONS:
+        raise KeyError(option)
+    window_length(window)
+    return PLOT_OPTIONS[f'{name}_today'][0], window, PLOT_OPTIONS[f'{name}_today'][2]
     
-    u_dby = meanwind_dby_dataset['eastward_wind'][y_locs]
-    u_y = meanwind_yesterday_dataset['eastward_wind'][:]
-    u_t = meanwind_today_dataset['eastward_wind'][:]
-    u = np.vstack((u_dby,u_y,u_t))
     
-    v_dby = meanwind_dby_dataset['northward_wind'][y_locs]
-    v_y = meanwind_yesterday_dataset['northward_wind'][:]
-    v_t = meanwind_today_dataset['northward_wind'][:]
-    v = np.vstack((v_dby,v_y,v_t))
     
-    ws_dby = meanwind_dby_dataset['wind_speed'][y_locs]    
-    ws_y = meanwind_yesterday_dataset['wind_speed'][:]
-    ws_t = meanwind_today_dataset['wind_speed'][:]
-    ws = np.vstack((ws_dby,ws_y,ws_t))
+def window_option(option, length):
+    """
+    Command line option for the plot of option over the last length, e.g.
+    '6h' or '7d', named as in PLOT_OPTIONS if it is one of them.
+    """
+    name = option.rpartition('_')[0]
+    window = f'last{length}'
+    for known in PLOT_OPTIONS:
+        if known.startswith(f'{name}_last') and window_length(plot_option(known)[1]) == window_length(window):
+            return known
+    return f'{name}_{window}'
     
-    y = meanwind_today_dataset['altitude'][:]
     
-    x,y = np.meshgrid(x,y)
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
+_worker_dataset_cache = None
+
+
+def _init_plot_worker():
+    """
+    Set up a plotting process pool worker with its own dataset cache,
+    reused by every plot it makes. Files are closed when the worker exits.
+    """
+    global _worker_dataset_cache
+    _worker_dataset_cache = DatasetCache()
     
-    pc = ax.pcolormesh(x,y,ws.T)
     
-    set_major_minor_date_ticks(ax)
     
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
-    ax.grid(which='both')
+def read_product(product, options, files, reference_time = None, dataset_cache = None, array_cache = None, also_unfiltered = False):
+    """
+    TimeSeries of the variables used by the plots for command line
+    options, all of product, read once from files given oldest first for
+    the longest of their windows ending at reference_time, with bad data
+    left out (see load_time_series). The files are closed once read.
+    """
+    with use_dataset_cache(_worker_dataset_cache if dataset_cache is None else dataset_cache) as dataset_cache:
+        longest = max((plot_option(option)[1] for option in options), key = lambda window: window_length(window) or dt.timedelta())
+        variables = []
+        for option in options:
+            variables += [ name for name in PLOTS[plot_option(option)[2]][1] if name not in variables ]
+            
+        if _metrics is not None:
+            _metrics.plot = product
+        try:
+            return load_time_series(window_files(files, longest, reference_time), variables, PRODUCT_HEIGHTS[product], window_start(longest, reference_time), dataset_cache,
+                                    only_good_data = True, array_cache = array_cache, end = None if reference_time is None else reference_time.timestamp(),
+                                    keep_unfiltered = also_unfiltered)
+        finally:
+            # everything needed is in the TimeSeries now
+            for f in files:
+                dataset_cache.evict(f)
+            
+            
+            
+def run_product_plots(product, options, files, output_location = '.', reference_time = None, bin_to_pixels = None, backscatter_binning = 'log-mean', max_memory = None, array_cache = None, dataset_cache = None,
+                      also_unfiltered = False, png_compression = 6, thumbnail_width = None, image_formats = (), series = None):
+    """
+    Make the plots for command line options, all of product, from files
+    given oldest first. The files are read once, for the longest window
+    asked for, and every plot is drawn from its own window of that data.
+    Returns {option: None if the plot was made, or the traceback if it
+    failed}, so that one bad plot does not stop the others being made.
+    bin_to_pixels and backscatter_binning are passed on to the plot. As
+    the command line only makes QC'd backscatter plots, bad data is left
+    out while the files are read. Windows end at reference_time, and
+    records after it are not read. If also_unfiltered, each backscatter
+    plot is also made with the bad data left in, from the same read.
+    
+    If max_memory (bytes) is given, each plot's window is instead
+    streamed from the files and binned to the plot's pixels as it is
+    read, with stream_time_series, so memory use does not grow with the
+    length of the window. Otherwise, if array_cache is given the data is
+    read through it (see load_time_series). If series, a TimeSeries of the
+    files read with only_good_data, is given, it is plotted instead of
+    reading them.
+    
+    Each plot is written by an ImageWriter with png_compression,
+    thumbnail_width and image_formats, encoding its images in the
+    background while the next plot is drawn.
+    """
+    # None outside a worker, as when called directly, and then files are opened for the call alone
+    if dataset_cache is None:
+        dataset_cache = _worker_dataset_cache
+    end = None if reference_time is None else reference_time.timestamp()
+    streamed = series is None and max_memory is not None
+        
+    if series is None and max_memory is None:
+        try:
+            series = read_product(product, options, files, reference_time, dataset_cache, array_cache, also_unfiltered)
+        except Exception:
+            error = traceback.format_exc()
+            return { option: error for option in options }
+            
+    errors = {}
+    # {option: futures of its images being written}
+    writing = {}
+    image_writer = ImageWriter(png_compression, thumbnail_width, image_formats, background = True)
+    try:
+        for option in options:
+            _, window, plot = plot_option(option)
+            kwargs = {'bin_to_pixels': bin_to_pixels, 'image_writer': image_writer}
+            if plot == 'aerosol-backscatter':
+                kwargs['backscatter_binning'] = backscatter_binning
+                if also_unfiltered:
+                    kwargs['unfiltered_output_file'] = output_filename(output_location, product, plot, window)
+            print(f'Making {option}')
+            if _metrics is not None:
+                _metrics.plot = option
+            try:
+                if not streamed:
+                    plot_series = series.window(window, reference_time)
+                else:
+                    binning = { name: backscatter_binning for name in QC_FLAGS } if plot == 'aerosol-backscatter' else None
+                    plot_series = stream_time_series(window_files(files, window, reference_time), PLOTS[plot][1], PRODUCT_HEIGHTS[product], plot_width_pixels(),
+                                                     window_start(window, reference_time), binning, max_memory, dataset_cache, only_good_data = True, end = end,
+                                                     keep_unfiltered = also_unfiltered)
+                PLOTS[plot][0](plot_series, output_filename(output_location, product, plot, window, plot == 'aerosol-backscatter'), **kwargs)
+                errors[option] = None
+            except Exception:
+                errors[option] = traceback.format_exc()
+            writing[option] = image_writer.pending
+            image_writer.pending = []
+    finally:
+        image_writer.close()
+        
+    for option, futures in writing.items():
+        for future in futures:
+            try:
+                seconds, nbytes = future.result()
+            except Exception:
+                errors[option] = errors[option] or traceback.format_exc()
+                continue
+            if _metrics is not None:
+                _metrics.plot = option
+                _metrics.add('encode', seconds, bytes = nbytes)
+    if streamed and dataset_cache is not None:
+        for f in files:
+            dataset_cache.evict(f)
+    return errors
+
+
+
+# records what each plot in an output location was made from, kept there unless another is given
+MANIFEST_FILE = 'plot_manifest.json'
+
+
+
+def plot_fingerprint(option, files, reference_time = None, times = None, **render_options):
+    """
+    What the plot for command line option is made from: the names, sizes
+    and modification times of the files it uses (from files, oldest
+    first), the time of the last record in its window ending at
+    reference_time, and the settings it is drawn with. times gives the
+    (first, last) timestamps of each file's records. The plot only needs
+    remaking when this changes, so a rolling window such as last24 is
+    remade when its files change, not each time its start moves on past
+    records of files that have not. None if any of the files cannot be
+    read.
+    """
+    window, plot = plot_option(option)[1:]
+    files = window_files(files, window, reference_time)
+    parameters = inspect.signature(PLOTS[plot][0]).parameters
+    settings = { name: p.default for name, p in parameters.items() if p.default is not p.empty }
+    settings.update( (name, value) for name, value in render_options.items() if name in parameters )
+    # how it is written is in settings['images']
+    settings.pop('image_writer', None)
+    # binned while reading
+    settings['streamed'] = render_options.get('max_memory') is not None
+    if 'unfiltered_output_file' in parameters:
+        # whether it is made alongside, rather than where
+        settings['unfiltered_output_file'] = bool(render_options.get('also_unfiltered'))
+    # and the images it is written as
+    settings['images'] = [render_options.get('png_compression', 6), render_options.get('thumbnail_width'), sorted(render_options.get('image_formats', ()))]
+    end = None if reference_time is None else reference_time.timestamp()
+    try:
+        last = times[files[-1]][1]
+        # an earlier --end gives an earlier last record; the window's start moves with it
+        return { 'files': [ [os.path.abspath(f), os.stat(f).st_size, os.stat(f).st_mtime] for f in files ],
+                 'last_record': last if end is None else min(end, last), 'settings': settings }
+    except (OSError, KeyError, TypeError, IndexError):
+        return None
+        
+        
+        
+def read_manifest(manifest_file):
+    """
+    {plot file name: fingerprint it was made from} from manifest_file,
+    empty if it cannot be read.
+    """
+    try:
+        with open(manifest_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+        
+        
+        
+def update_manifest(manifest_file, changes):
+    """
+    Apply changes {plot file name: fingerprint it was made from, or None
+    to forget it} to manifest_file. The manifest is read again and changed
+    under a lock, so that runs making plots into the same location at
+    once, e.g. from cron and --watch, keep each other's changes.
+    """
+    import fcntl
+    with open(f'{manifest_file}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(manifest_file)
+        for name, fingerprint in changes.items():
+            if fingerprint is None:
+                manifest.pop(name, None)
+            else:
+                manifest[name] = fingerprint
+        # write then rename, so an interrupted run cannot leave half a manifest
+        with open(f'{manifest_file}.{os.getpid()}.tmp', 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        os.replace(f'{manifest_file}.{os.getpid()}.tmp', manifest_file)
+        
+        
+        
+def _measured_product_plots(*args, **kwargs):
+    """
+    run_product_plots, recording Metrics of it. Returns its results and
+    the metrics records.
+    """
+    global _metrics
+    _metrics = Metrics()
+    try:
+        return run_product_plots(*args, **kwargs), _metrics.records
+    finally:
+        _metrics = None
+        
+        
+        
+def parse_size(size):
+    """
+    Number of bytes in size, e.g. '512M', '2G' or '1000000'.
+    """
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
     
-    cbar = fig.colorbar(pc, ax = ax)
-    cbar.ax.set_ylabel('Wind speed (m s-1)')
-    ax.barbs(x[::barb_interval,::barb_interval], y[::barb_interval,::barb_interval], u[::barb_interval,::barb_interval].T, v[::barb_interval,::barb_interval].T, length = 7)
     
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_speed-direction_last48.png')
-    plt.close()
+def parse_time(time):
+    """
+    UTC datetime of ISO 8601 time, e.g. '2024-06-01T12:00', taken to be
+    UTC if it has no time zone.
+    """
+    time = dt.datetime.fromisoformat(time)
+    if time.tzinfo is None:
+        return time.replace(tzinfo = dt.timezone.utc)
+    return time.astimezone(dt.timezone.utc)
     
     
     
-def wind_profile_mean_winds_upward_velocity_last48(meanwind_daybeforeyesterday_file, meanwind_yesterday_file, meanwind_today_file, output_location = '.', image_file = 'NCAS_national_centre_logo_transparent-768x184.png'):
+class Prefetcher:
     """
-    Create plot of upward air velocity from Wind Profile data
+    Iterates over (item, Future of read(item)) for each of items in turn,
+    reading up to depth items ahead on a background thread, so that the
+    next items are read while the current one is used. At most depth
+    reads are kept waiting to be used, which caps the memory they hold.
+    Reads are done one at a time, as the HDF5 library is not thread safe.
     """
-    meanwind_dby_dataset = Dataset(meanwind_daybeforeyesterday_file)
-    meanwind_yesterday_dataset = Dataset(meanwind_yesterday_file)
-    meanwind_today_dataset = Dataset(meanwind_today_file)
+    def __init__(self, read, items, depth = 1):
+        self._read = read
+        self._items = iter(items)
+        self._depth = depth
+        self._queue = deque()
+        self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'prefetch')
+        
+    def __iter__(self):
+        return self
+        
+    def __next__(self):
+        # the item given out before is done with, so its place can be taken
+        for item in self._items:
+            self._queue.append((item, self._executor.submit(self._read, item)))
+            if len(self._queue) > self._depth:
+                break
+        if not self._queue:
+            raise StopIteration
+        return self._queue.popleft()
+            
+    def close(self):
+        for _, future in self._queue:
+            future.cancel()
+        self._queue.clear()
+        self._executor.shutdown()
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+        
+        
+        
+def make_plots(product_plots, product_files, output_location = '.', reference_time = None, executor = None, dataset_cache = None, force = False, metrics = None,
+               prefetch = 1, catalog = None, manifest_file = None, **render_options):
+    """
+    Make plots {product: [command line options]} from product_files
+    {product: [files, oldest first]}, in the worker processes of executor
+    if given. render_options are passed on to run_product_plots.
+    Plots already made from the same data and settings, as recorded in
+    manifest_file (by default MANIFEST_FILE in output_location), are
+    skipped unless force is True. The
+    times of the files' records are taken from catalog (a
+    lidar_catalog.Catalog) if given, otherwise read through dataset_cache.
+    If metrics is given the timings of making the plots are added to it.
+    Without executor, the next prefetch products' files are read in the
+    background while a product's plots are drawn and saved, unless
+    prefetch is 0 or render_options has max_memory. Returns {option: None
+    if the plot was made or is up to date, or the traceback}.
+    """
+    global _metrics
+    with use_dataset_cache(dataset_cache) as cache:
+        manifest_file = manifest_file or os.path.join(output_location, MANIFEST_FILE)
+        manifest = read_manifest(manifest_file)
+        # only for the names of the images written
+        writer = ImageWriter(thumbnail_width = render_options.get('thumbnail_width'), image_formats = render_options.get('image_formats', ()))
+        times = {}
+        for f in { f for files in product_files.values() for f in files }:
+            if catalog is not None:
+                times[f] = catalog.times(f)
+                continue
+            try:
+                file_times = cache.variable(f, 'time')
+                times[f] = (float(file_times[0]), float(file_times[-1]))
+            except (OSError, IndexError):
+                pass
+        fingerprints = {}
+        results = {}
+        to_make = {}
+        for product, options in product_plots.items():
+            for option in options:
+                window, plot = plot_option(option)[1:]
+                output_file = output_filename(output_location, product, plot, window, plot == 'aerosol-backscatter')
+                fingerprints[option] = (os.path.basename(output_file), plot_fingerprint(option, product_files[product], reference_time, times, **render_options))
+                also_made = [ output_filename(output_location, product, plot, window) ] if render_options.get('also_unfiltered') and plot == 'aerosol-backscatter' else []
+                images = [ f for made in [output_file] + also_made for f in writer.output_files(made) ]
+                if not force and all(os.path.exists(f) for f in images) and fingerprints[option][1] is not None and manifest.get(fingerprints[option][0]) == fingerprints[option][1]:
+                    print(f'{option} is up to date, skipping... ')
+                    results[option] = None
+                    continue
+                to_make.setdefault(product, []).append(option)
+        product_plots = to_make
+        
+        run = run_product_plots if metrics is None else _measured_product_plots
+        def collect(result):
+            if metrics is not None:
+                result, records = result
+                metrics.records += records
+            results.update(result)
+            
+        if executor is not None:
+            for f in times:
+                cache.evict(f)
+            futures = { product: executor.submit(run, product, options, product_files[product], output_location, reference_time, **render_options)
+                        for product, options in product_plots.items() }
+            for product, future in futures.items():
+                try:
+                    collect(future.result())
+                except Exception:
+                    # worker died, e.g. crashed in the HDF5 library
+                    results.update({ option: traceback.format_exc() for option in product_plots[product] })
+        elif not prefetch or render_options.get('max_memory') is not None:
+            for product, options in product_plots.items():
+                collect(run(product, options, product_files[product], output_location, reference_time, dataset_cache = cache, **render_options))
+        else:
+            # set for all the products, so reads done ahead in the background are recorded too
+            _metrics = metrics
+            try:
+                def read(item):
+                    product, options = item
+                    return read_product(product, options, product_files[product], reference_time, cache, render_options.get('array_cache'),
+                                        render_options.get('also_unfiltered', False))
+                    
+                with Prefetcher(read, product_plots.items(), prefetch) as reads:
+                    for (product, options), series in reads:
+                        try:
+                            series = series.result()
+                        except Exception:
+                            results.update({ option: traceback.format_exc() for option in options })
+                            continue
+                        results.update(run_product_plots(product, options, product_files[product], output_location, reference_time,
+                                                         dataset_cache = cache, series = series, **render_options))
+                        # let go of it before the next product's read is started
+                        del series
+            finally:
+                _metrics = None
+                
+    changes = {}
+    for option, error in results.items():
+        name, fingerprint = fingerprints[option]
+        changes[name] = fingerprint if error is None else None
+    if changes:
+        update_manifest(manifest_file, changes)
+    return results
     
-    current_time = dt.datetime.now(dt.timezone.utc)
-    time_minus_48 = current_time - dt.timedelta(days=2)
-    time_minus_48_timestamp = time_minus_48.timestamp()
     
-    y_locs = np.where(meanwind_dby_dataset['time'][:] > time_minus_48_timestamp)[0]
     
-    dby_times = meanwind_dby_dataset['time'][:][y_locs]
-    y_times = meanwind_yesterday_dataset['time'][:]
-    t_times = meanwind_today_dataset['time'][:]
-    times = np.hstack((dby_times, y_times,t_times))
-    x = [ dt.datetime.fromtimestamp(i, dt.timezone.utc) for i in times ]
+"""
+Keeping plots up to date as data arrives
+"""
+
+# product: how its files are named
+PRODUCT_FILE_NAMES = {
+    'stare': 'aerosol-backscatter-radial-winds_stare',
+    'wind-profile': 'aerosol-backscatter-radial-winds_wind-profile',
+    'mean-winds': 'mean-winds-profile',
+}
+
+
+
+# kept in the output location unless another is given
+CATALOG_FILE = 'ncas-lidar-dop-2_catalog.sqlite'
+
+
+
+def open_catalog(catalog_file = None, output_location = '.'):
+    """
+    Catalog kept in catalog_file, by default in output_location, making
+    its directory if it does not exist yet.
+    """
+    catalog_file = catalog_file or os.path.join(output_location, CATALOG_FILE)
+    os.makedirs(os.path.dirname(os.path.abspath(catalog_file)), exist_ok = True)
+    return Catalog(catalog_file)
     
-    y = meanwind_today_dataset['altitude'][:]
     
-    w_dby = meanwind_dby_dataset['upward_air_velocity'][:][y_locs]
-    w_y = meanwind_yesterday_dataset['upward_air_velocity'][:]
-    w_t = meanwind_today_dataset['upward_air_velocity'][:]
-    w = np.vstack((w_dby,w_y,w_t))
     
-    fig = plt.figure(figsize=(20,8))
-    fig.set_facecolor('white')
-    ax = fig.add_subplot(111)
+def catalog_files(catalog, product, reference_time, days = 3, site = None):
+    """
+    Files of product for the days up to reference_time, oldest first,
+    from catalog (a lidar_catalog.Catalog). Days without a file are left
+    out, so there may be fewer files than days, or none.
+    """
+    first_day = dt.datetime.combine(reference_time.date() - dt.timedelta(days = days - 1), dt.time(), dt.timezone.utc)
+    files = catalog.files(PRODUCT_FILE_NAMES[product], first_day.timestamp(), reference_time.timestamp(), site)
+    # not the file of the day before, for its last records after midnight
+    return [ f for f in files if catalog.date(f) >= first_day.strftime('%Y%m%d') ]
     
-    c = ax.pcolormesh(x,y,w.T, cmap='RdBu_r', vmin = -5, vmax = 5)
     
-    set_major_minor_date_ticks(ax)
     
-    ax.grid(which='both')
-    ax.set_ylabel('Altitude (m)')
-    ax.set_xlabel('Time')
+class DirectoryWatcher:
+    """
+    Waits for files in a directory to be written, using inotify if the
+    optional inotify_simple package is installed, or otherwise just
+    sleeping so that the caller polls.
+    """
+    def __init__(self, directory):
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            self._inotify = None
+        else:
+            self._inotify = INotify()
+            self._inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE)
+            
+    def wait(self, timeout):
+        """
+        Return after timeout seconds, or sooner if a file is written.
+        """
+        if self._inotify is None:
+            time.sleep(timeout)
+        else:
+            # wait a second after the first event to gather any that follow
+            self._inotify.read(timeout = int(timeout * 1000), read_delay = 1000)
+            
+            
+            
+def _file_fingerprint(files):
+    """
+    (name, size, modification time) of each of files, or None if any is
+    missing.
+    """
+    try:
+        return tuple( (f, os.stat(f).st_size, os.stat(f).st_mtime) for f in files )
+    except (TypeError, FileNotFoundError):
+        return None
+        
+        
+        
+def watch(directory, options, output_location = '.', poll_interval = 60, settle_time = 30, executor = None, metrics_file = None,
+          catalog_file = None, site = None, **render_options):
+    """
+    Keep the plots for command line options up to date with the netCDF
+    files in directory, remaking a plot only when one of its input files
+    changes. A file modified in the last settle_time seconds is taken to
+    be still being written, and is waited for. The days plotted roll over
+    at midnight UTC. If metrics_file is given, timings of each round of
+    plots are written to it as by Metrics.write. The files are found with
+    a Catalog kept in catalog_file, by default in output_location, only
+    using those of site if given. A round that fails is reported and
+    tried again at the next poll. Runs until interrupted.
+    """
+    watcher = DirectoryWatcher(directory)
+    catalog = open_catalog(catalog_file, output_location)
+    made_from = {}
+    while True:
+        now = dt.datetime.now(dt.timezone.utc)
+        settling = False
+        try:
+            catalog.update(directory)
+            
+            product_plots = {}
+            product_files = {}
+            fingerprints = {}
+            for option in options:
+                product, window = plot_option(option)[:2]
+                files = catalog_files(catalog, product, now, window_days(window, now), site)
+                fingerprint = _file_fingerprint(files)
+                if not files or fingerprint is None or fingerprint == made_from.get(option):
+                    continue
+                if any(now.timestamp() - mtime < settle_time for _, _, mtime in fingerprint):
+                    settling = True
+                    continue
+                fingerprints[option] = fingerprint
+                product_plots.setdefault(product, []).append(option)
+                if len(files) > len(product_files.get(product, [])):
+                    product_files[product] = files
+                    
+            if product_plots:
+                metrics = None if metrics_file is None else Metrics()
+                results = make_plots(product_plots, product_files, output_location, now, executor, metrics = metrics, catalog = catalog, **render_options)
+                if metrics is not None:
+                    metrics.write(metrics_file)
+                for option, error in results.items():
+                    if error is not None:
+                        print(f'Failed to make {option}:\n{error}', file = sys.stderr)
+                    # a failed plot is tried again when its files next change
+                    made_from[option] = fingerprints[option]
+                    
+        except Exception:
+            # e.g. a file that cannot be read or a full disk, so try again next round
+            print(f'Failed to update the plots:\n{traceback.format_exc()}', file = sys.stderr)
+            
+        until_midnight = (dt.datetime.combine(now.date() + dt.timedelta(days = 1), dt.time(), dt.timezone.utc) - now).total_seconds()
+        watcher.wait(min(settle_time if settling else poll_interval, until_midnight + 1))
+        
+        
+        
+"""
+Reprocessing the archive
+"""
+
+# kept in the output location, recording which days have been reprocessed
+PROGRESS_FILE = 'reprocess_progress.jsonl'
+
+
+
+def day_end(date):
+    """
+    Time the plots of a whole day, date, end at: the last moment of it.
+    """
+    return dt.datetime.combine(date, dt.time.max, dt.timezone.utc)
     
-    cbar = fig.colorbar(c, ax = ax)
-    cbar.ax.set_ylabel(f"Upward air velocity {meanwind_today_dataset['upward_air_velocity'].units}")
     
-    im = image.imread(image_file)
-    newax = fig.add_axes([0.62,0.75,0.12,0.12], anchor='NE')
-    newax.imshow(im)
-    newax.axis('off')
     
-    plt.savefig(f'{output_location}/plot_ncas-lidar-dop-2_wind-profile_mean-winds_upward-velocity_last48.png')
-    plt.close()
+def read_progress(output_location):
+    """
+    {date (YYYYMMDD): its latest record} from the reprocessing progress
+    file in output_location, empty if there is none.
+    """
+    progress = {}
+    try:
+        with open(os.path.join(output_location, PROGRESS_FILE)) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # cut short by being interrupted
+                    continue
+                progress[record['date']] = record
+    except OSError:
+        pass
+    return progress
+    
+    
+    
+def _append_progress(output_location, record):
+    # one write to a file opened for appending, so processes writing at once do not interleave
+    fd = os.open(os.path.join(output_location, PROGRESS_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record) + '\n').encode())
+    finally:
+        os.close(fd)
+        
+        
+        
+def reprocess_days(days, product_plots, output_location = '.', settings = None, dataset_cache = None, measure = False, **render_options):
+    """
+    Make the plots for product_plots {product: [command line options]} as
+    they were at the end of each of days, [(date, {product: [files,
+    oldest first]}, fingerprint of the files)] in date order, into a
+    directory for each day (YYYYMMDD) in output_location. Each file is
+    decoded once, and kept for as long as later days still use it.
+    render_options are passed on to run_product_plots. Once a day is done
+    it is recorded in the progress file with settings and its files'
+    fingerprint. Options without any files for their window on a day
+    are recorded as having no input rather than failing. Returns {date:
+    [options which failed]}, and if measure is True the records of
+    Metrics of making them.
+    """
+    global _metrics
+    if measure:
+        _metrics = Metrics()
+    try:
+        with use_dataset_cache(_worker_dataset_cache if dataset_cache is None else dataset_cache) as dataset_cache:
+            failed = _reprocess_days(days, product_plots, output_location, settings, dataset_cache, **render_options)
+        return (failed, _metrics.records) if measure else failed
+    finally:
+        _metrics = None
+        
+        
+        
+def _reprocess_days(days, product_plots, output_location, settings, dataset_cache, **render_options):
+    decoded = {}
+    failed = {}
+    for date, product_files, fingerprint in days:
+        print(f'Reprocessing {date}')
+        reference_time = day_end(date)
+        day_location = os.path.join(output_location, date.strftime('%Y%m%d'))
+        # the days are in order, so a file not used today is not used again
+        needed = { f for files in product_files.values() for f in files }
+        decoded = { f: series for f, series in decoded.items() if f in needed }
+        
+        failed[date] = []
+        # not failures, so they do not stop the day being skipped when resuming
+        no_input = []
+        for product, options in product_plots.items():
+            files = product_files[product]
+            enough = [ option for option in options if window_files(files, plot_option(option)[1], reference_time) ]
+            for option in options:
+                if option not in enough:
+                    print(f'No {product} netCDF files for {option} on {date}, skipping... ')
+                    no_input.append(option)
+            if not enough:
+                continue
+            variables = []
+            for option in enough:
+                variables += [ name for name in PLOTS[plot_option(option)[2]][1] if name not in variables ]
+            if _metrics is not None:
+                _metrics.plot = product
+            try:
+                for f in files:
+                    if f not in decoded or any(name not in decoded[f].variables for name in variables):
+                        decoded[f] = load_time_series([f], variables, PRODUCT_HEIGHTS[product], dataset_cache = dataset_cache, only_good_data = True,
+                                                      array_cache = render_options.get('array_cache'), keep_unfiltered = render_options.get('also_unfiltered', False))
+                        dataset_cache.evict(f)
+                series = join_time_series([ decoded[f] for f in files ])
+            except Exception:
+                print(f'Failed to read {product} files for {date}:\n{traceback.format_exc()}', file = sys.stderr)
+                failed[date] += enough
+                continue
+            # only made for days with something to plot
+            os.makedirs(day_location, exist_ok = True)
+            errors = run_product_plots(product, enough, files, day_location, reference_time, dataset_cache = dataset_cache, series = series, **render_options)
+            for option, error in errors.items():
+                if error is not None:
+                    print(f'Failed to make {option} for {date}:\n{error}', file = sys.stderr)
+                    failed[date].append(option)
+        _append_progress(output_location, {'date': date.strftime('%Y%m%d'), 'settings': settings, 'files': fingerprint, 'failed': failed[date],
+                                           'no_input': no_input})
+    return failed
+    
+    
+    
+def reprocess(catalog, start, end, product_plots, output_location = '.', executor = None, jobs = 1, force = False, site = None, metrics = None, **render_options):
+    """
+    Remake the plots for product_plots {product: [command line options]}
+    for every day from date start to end, from the files in catalog (a
+    lidar_catalog.Catalog), as they were at the end of each day. Days
+    already reprocessed with the same plots, settings and files, as
+    recorded in the progress file in output_location, are skipped unless
+    force is True, so an interrupted run carries on where it stopped. The
+    days are split into jobs runs of consecutive days, each made by
+    reprocess_days in a worker process of executor if given. If metrics
+    is given the timings of making the plots are added to it. Returns
+    {date: [options which failed]}, leaving out those without any files
+    for their window, and counting every option of a day as failed if
+    its files have gone since catalog was updated.
+    """
+    # what the plots are made with, other than their files
+    settings = hashlib.sha1(json.dumps({'plots': product_plots, 'render': { name: value for name, value in render_options.items() if name != 'array_cache' }},
+                                       sort_keys = True, default = str).encode()).hexdigest()
+    progress = {} if force else read_progress(output_location)
+    days = []
+    failed = {}
+    for n in range((end - start).days + 1):
+        date = start + dt.timedelta(days = n)
+        product_files = {}
+        for product, options in product_plots.items():
+            ndays = max(window_days(plot_option(option)[1], day_end(date)) for option in options)
+            product_files[product] = catalog_files(catalog, product, day_end(date), ndays, site)
+        fingerprint = [ _file_fingerprint(files) for files in product_files.values() ]
+        if None in fingerprint:
+            # removed since the catalog was updated
+            print(f'{date} has netCDF files which have gone, skipping... ', file = sys.stderr)
+            failed[date] = [ option for options in product_plots.values() for option in options ]
+            continue
+        fingerprint = [ list(file) for files in fingerprint for file in files ]
+        done = progress.get(date.strftime('%Y%m%d'))
+        if done is not None and not done['failed'] and done['settings'] == settings and done['files'] == fingerprint:
+            continue
+        days.append((date, product_files, fingerprint))
+    print(f'{len(days)} of {(end - start).days + 1} days to reprocess')
+    
+    runs = [ days[i:i + -(-len(days) // jobs)] for i in range(0, len(days), -(-len(days) // jobs)) ] if days else []
+    def collect(result):
+        if metrics is not None:
+            result, records = result
+            metrics.records += records
+        failed.update(result)
+        
+    if executor is None:
+        with DatasetCache() as dataset_cache:
+            for run in runs:
+                collect(reprocess_days(run, product_plots, output_location, settings, dataset_cache, metrics is not None, **render_options))
+        return failed
+    futures = [ executor.submit(reprocess_days, run, product_plots, output_location, settings, None, metrics is not None, **render_options) for run in runs ]
+    for future, run in zip(futures, runs):
+        try:
+            collect(future.result())
+        except Exception:
+            # worker died, e.g. crashed in the HDF5 library
+            error = traceback.format_exc()
+            print(f'Failed to reprocess {run[0][0]} to {run[-1][0]}:\n{error}', file = sys.stderr)
+            failed.update({ date: [ option for options in product_plots.values() for option in options ] for date, _, _ in run })
+    return failed
+
 
 
 
@@ -667,11 +2116,52 @@ if __name__ == "__main__":
     stare_aerosol_backscatter_last48(stare_dby_file, stare_yesterday_file, stare_today_file)
     #stare_aerosol_backscatter_today(stare_today_file)
     """
+    # plots are only ever saved to file, never shown, so skip looking for a
+    # GUI backend; worker processes inherit this
+    os.environ['MPLBACKEND'] = 'Agg'
+    
     import argparse
     parser = argparse.ArgumentParser(description = 'Make plots for ncas-lidar-dop-2.', allow_abbrev=False, argument_default=argparse.SUPPRESS)
-    parser.add_argument('netCDFs', nargs = '+', help = "netCDF files with data to be plotted. At minimum today's file should be given, \
-                                                        as well as yesterday's for 24 hour plots and the day before yesterday's for 48 hour plots.")
+    parser.add_argument('netCDFs', nargs = '*', help = "netCDF files with data to be plotted. At minimum today's file should be given, \
+                                                        as well as yesterday's for 24 hour plots and the day before yesterday's for 48 hour plots. \
+                                                        Not needed with --watch.")
+    parser.add_argument('--metrics', default = None, metavar = 'FILE', help = "Record how long each phase of making each plot takes, and its peak memory, \
+                                                                              appended to FILE as JSON lines, or as a Prometheus textfile collector file if FILE ends in .prom.")
+    parser.add_argument('--max-memory', type = parse_size, default = None, metavar = 'SIZE', help = "Read each plot's data a piece at a time, binned to the plot's pixels as it is read, \
+                                                                                                   holding no more than about SIZE (e.g. 512M or 2G) of it at once.")
+    parser.add_argument('--prefetch', type = int, default = 1, metavar = 'N', help = "Read the files of up to N products ahead in the background while plots are drawn and saved, \
+                                                                                 holding at most N products' data besides the one being plotted. 0 reads each product's files only when it is plotted. \
+                                                                                 Not used with --jobs over 1 or --max-memory. Default is 1.")
+    parser.add_argument('--cache-dir', default = None, metavar = 'DIRECTORY', help = "Keep decoded data from netCDF files in DIRECTORY, so it is not read again from them on later runs. \
+                                                                                    Files modified in the last hour are taken to be still being written, and only their new records are read.")
+    parser.add_argument('--cache-size', type = parse_size, default = '2G', metavar = 'SIZE', help = "Largest size of --cache-dir before the least recently used data is deleted. Default is 2G.")
+    parser.add_argument('--force', action = 'store_true', default = False, help = "Remake plots even if their data and settings have not changed since they were last made.")
+    parser.add_argument('--data-dir', default = None, metavar = 'DIRECTORY', help = "Find the netCDF files needed in DIRECTORY, instead of giving them.")
+    parser.add_argument('--catalog', default = None, metavar = 'FILE', help = f"SQLite index of the files in --data-dir or --watch, updated on each run. Default is {CATALOG_FILE} in the output location.")
+    parser.add_argument('--site', default = None, help = "Only use files from this site with --data-dir or --watch, e.g. iao. Needed if there are files from more than one site.")
+    parser.add_argument('--manifest', default = None, metavar = 'FILE', help = f"JSON record of what each plot was made from, so unchanged plots are not remade. Default is {MANIFEST_FILE} in the output location.")
+    parser.add_argument('--watch', default = None, metavar = 'DIRECTORY', help = "Keep running, and remake plots whenever the netCDF files they use in DIRECTORY change.")
+    parser.add_argument('--poll-interval', type = float, default = 60, help = "With --watch, seconds between checks for changed files if inotify_simple is not installed. Default is 60.")
+    parser.add_argument('--settle-time', type = float, default = 30, help = "With --watch, seconds a file must be left unmodified before it is plotted. Default is 30.")
+    parser.add_argument('--window', action = 'append', default = None, metavar = 'LENGTH', help = "Make the plots asked for over the last LENGTH of data instead, \
+                                                                                                   in hours or days, e.g. 6h, 72h or 7d. Can be given more than once.")
+    parser.add_argument('--end', type = parse_time, default = None, metavar = 'TIME', help = "UTC time the plots end at, e.g. 2024-06-01T12:00, \
+                                                                                            so that they can be made again the same. Default is now.")
+    parser.add_argument('--reprocess', nargs = 2, type = dt.date.fromisoformat, default = None, metavar = ('START', 'END'), help = "Remake the plots asked for, \
+                        as they were at the end of each day from START to END (e.g. 2024-01-01 2024-12-31), from the files in --data-dir, into a directory for each day in the output location. \
+                        Each file is decoded once, and an interrupted run carries on from where it stopped.")
+    parser.add_argument('--also-unfiltered', action = 'store_true', default = False, help = "Also make each aerosol backscatter plot with the data its QC flags mark as bad left in, \
+                                                                                               from the same read of the files, saved without _qc in its name.")
+    parser.add_argument('--png-compression', type = int, choices = range(10), default = 6, metavar = 'LEVEL', help = "zlib compression level of the PNG plots, \
+                                                                                                             from 0 (fastest, largest files) to 9 (slowest, smallest). Default is 6.")
+    parser.add_argument('--thumbnail-width', type = int, default = None, metavar = 'PIXELS', help = "Also save a thumbnail of each plot, PIXELS wide, named like it with _thumbnail added.")
+    parser.add_argument('--image-format', action = 'append', choices = list(IMAGE_EXTENSIONS), default = None, dest = 'image_formats',
+                        help = "Also save each plot as an image in this format, named like it. Can be given more than once.")
     parser.add_argument('-o','--output-location', default = ".", help = "Location of where to save plots. Default is '.'.")
+    parser.add_argument('--bin-to-pixels', choices = ['time', 'time-height'], default = None, help = "Average data to the pixels of the plot along time, or time and height, before drawing it. Default is to draw every profile.")
+    parser.add_argument('--backscatter-binning', choices = ['log-mean', 'max'], default = 'log-mean', help = "How --bin-to-pixels combines aerosol backscatter. Default is 'log-mean'.")
+    parser.add_argument('-j','--jobs', type = int, default = 1, help = "Number of processes to make plots in. Each product's plots are made in one process, \
+                                                                        so no more than 3 are used, or with --reprocess each process makes a run of consecutive days. Default is 1.")
     parser.add_argument('-s','--stare-aerosol-backscatter-today', action='store_true', help = 'Make plot of aerosol backscatter for today from Stare data.')
     parser.add_argument('-w','--wp-aerosol-backscatter-today', action='store_true', help = 'Make plot of aerosol backscatter for today from Wind Profile data.')
     parser.add_argument('-u','--speed-direction-today', action='store_true', help = 'Make plot of wind speed and direction for today.')
@@ -690,7 +2180,33 @@ if __name__ == "__main__":
     
     
     given_args = args._get_kwargs()
-    netcdf_files = args.netCDFs
+    netcdf_files = getattr(args, 'netCDFs', [])
+    if not netcdf_files and args.watch is None and args.data_dir is None:
+        parser.error('netCDF files are needed unless --data-dir or --watch is given')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.prefetch < 0:
+        parser.error('--prefetch cannot be negative')
+    if args.watch is not None and args.end is not None:
+        parser.error('--end cannot be used with --watch, which follows the current time')
+    if args.reprocess is not None:
+        if args.data_dir is None:
+            parser.error('--reprocess needs --data-dir')
+        if args.watch is not None or args.end is not None:
+            parser.error('--reprocess cannot be used with --watch or --end')
+        if args.max_memory is not None:
+            parser.error('--reprocess keeps whole files in memory, so cannot be used with --max-memory')
+        if args.reprocess[0] > args.reprocess[1]:
+            parser.error('--reprocess START is after END')
+    if 'webp' in (args.image_formats or []):
+        from PIL import features
+        if not features.check('webp'):
+            parser.error('--image-format webp needs Pillow built with WebP support')
+    for length in args.window or []:
+        try:
+            window_length(f'last{length}')
+        except ValueError:
+            parser.error(f'--window {length} is not a number of hours or days, e.g. 6h or 7d')
     
     # Check no repeated netCDF files
     if len(set(netcdf_files)) != len(netcdf_files):
@@ -705,135 +2221,112 @@ if __name__ == "__main__":
         raise ValueError(msg)
     
     
-    # Check not too many netCDF files
-    stare_netcdfs = [ f for f in netcdf_files if 'aerosol-backscatter-radial-winds_stare' in f ]
-    if len(stare_netcdfs) > 3:
-        msg = "Too many netCDF files for aerosol-backscatter-radial-winds_stare"
-        raise ValueError(msg)
-    stare_dates = [ f.split('ncas-lidar-dop-2')[1].split('_')[2] for f in stare_netcdfs ]
-    
-    # Check no repeated dates
-    if len(set(stare_dates)) != len(stare_dates):
-        counter = Counter(stare_netcdfs)
-        msg = 'the following dates have been given more than once for aerosol-backscatter-radial-winds_stare:'
-        for i in counter.items():
-            if i[1] > 1:
-                msg += ' '
-                msg += str(i[0])
-                msg += ','
-        msg = msg[:-1]  # remove trailing comma
-        raise ValueError(msg)
-        
-    # order files by date in reverse, i.e. today's file first
-    reversed_dates = sorted(stare_dates, reverse=True)
-    stare_netcdf_ordered = []
-    for d in reversed_dates:
-        for f in stare_netcdfs:
-            if d in f:
-                stare_netcdf_ordered.append(f)
-                break
-    
-    
-    # Check not too many netCDF files
-    wp_netcdfs = [ f for f in netcdf_files if 'aerosol-backscatter-radial-winds_wind-profile' in f ]
-    if len(wp_netcdfs) > 3:
-        msg = "Too many netCDF files for aerosol-backscatter-radial-winds_wind-profile"
-        raise ValueError(msg)
-    wp_dates = [ f.split('ncas-lidar-dop-2')[1].split('_')[2] for f in wp_netcdfs ]
-    
-    # Check no repeated dates
-    if len(set(wp_dates)) != len(wp_dates):
-        counter = Counter(wp_dates)
-        msg = 'the following dates have been given more than once for aerosol-backscatter-radial-winds_wind-profile:'
-        for i in counter.items():
-            if i[1] > 1:
-                msg += ' '
-                msg += str(i[0])
-                msg += ','
-        msg = msg[:-1]  # remove trailing comma
-        raise ValueError(msg)
+    # each product's files, today's first
+    netcdf_ordered = {}
+    for f in netcdf_files:
+        if parse_filename(f) is None:
+            print(f'{f} is not named like an ncas-lidar-dop-2 netCDF file, skipping... ')
+    for product, file_product in PRODUCT_FILE_NAMES.items():
+        files = [ f for f in netcdf_files if (parse_filename(f) or {}).get('product') == file_product ]
+        dates = [ parse_filename(f)['date'] for f in files ]
         
-    # order files by date in reverse, i.e. today's file first
-    reversed_dates = sorted(wp_dates, reverse=True)
-    wp_netcdf_ordered = []
-    for d in reversed_dates:
-        for f in wp_netcdfs:
-            if d in f:
-                wp_netcdf_ordered.append(f)
-                break
-    
-    
-    # Check not too many netCDF files
-    meanwinds_netcdfs = [ f for f in netcdf_files if 'mean-winds-profile' in f ]
-    if len(meanwinds_netcdfs) > 3:
-        msg = "Too many netCDF files for mean-winds-profile"
-        raise ValueError(msg)
-    mw_dates = [ f.split('ncas-lidar-dop-2')[1].split('_')[2] for f in meanwinds_netcdfs ]
-    
-    # Check no repeated dates
-    if len(set(mw_dates)) != len(mw_dates):
-        counter = Counter(mw_dates)
-        msg = 'the following dates have been given more than once for mean-winds-profile:'
-        for i in counter.items():
-            if i[1] > 1:
-                msg += ' '
-                msg += str(i[0])
-                msg += ','
-        msg = msg[:-1]  # remove trailing comma
-        raise ValueError(msg)
+        # Check no repeated dates
+        if len(set(dates)) != len(dates):
+            repeated = [ date for date, count in Counter(dates).items() if count > 1 ]
+            msg = f"the following dates have been given more than once for {file_product}: {', '.join(repeated)}"
+            raise ValueError(msg)
+            
+        netcdf_ordered[product] = sorted(files, key = lambda f: parse_filename(f)['date'], reverse = True)
         
-    # order files by date in reverse, i.e. today's file first
-    reversed_dates = sorted(mw_dates, reverse=True)
-    meanwinds_netcdf_ordered = []
-    for d in reversed_dates:
-        for f in meanwinds_netcdfs:
-            if d in f:
-                meanwinds_netcdf_ordered.append(f)
-                break
-                
-                
-    # make the requested plots
+    # the plots asked for
+    plots = []
     for i in given_args:
-        if i[0] not in  ['netCDFs', 'output_location']:
-            if i[0] == 'stare_aerosol_backscatter_today':
-                print('Making stare_aerosol_backscatter_today')
-                stare_aerosol_backscatter_today(stare_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'stare_aerosol_backscatter_last24':
-                print('Making stare_aerosol_backscatter_last24')
-                stare_aerosol_backscatter_last24(stare_netcdf_ordered[1], stare_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'stare_aerosol_backscatter_last48':
-                print('Making stare_aerosol_backscatter_last48')
-                stare_aerosol_backscatter_last48(stare_netcdf_ordered[2], stare_netcdf_ordered[1], stare_netcdf_ordered[0], output_location = args.output_location)
-                
-            elif i[0] == 'wp_aerosol_backscatter_today':
-                print('Making wp_aerosol_backscatter_today')
-                wind_profile_aerosol_backscatter_today(wp_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'wp_aerosol_backscatter_last24':
-                print('Making wp_aerosol_backscatter_last24')
-                wind_profile_aerosol_backscatter_last24(wp_netcdf_ordered[1], wp_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'wp_aerosol_backscatter_last48':
-                print('Making wp_aerosol_backscatter_last48')
-                wind_profile_aerosol_backscatter_last48(wp_netcdf_ordered[2], wp_netcdf_ordered[1], wp_netcdf_ordered[0], output_location = args.output_location)
-                
-            elif i[0] == 'speed_direction_today':
-                print('Making speed_direction_today')
-                wind_profile_mean_winds_speed_direction_today(meanwinds_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'speed_direction_last24':
-                print('Making speed_direction_last24')
-                wind_profile_mean_winds_speed_direction_last24(meanwinds_netcdf_ordered[1], meanwinds_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'speed_direction_last48':
-                print('Making speed_direction_last48')
-                wind_profile_mean_winds_speed_direction_last48(meanwinds_netcdf_ordered[2], meanwinds_netcdf_ordered[1], meanwinds_netcdf_ordered[0], output_location = args.output_location)
-                
-            elif i[0] == 'vertical_velocity_today':
-                print('Making vertical_velocity_today')
-                wind_profile_mean_winds_upward_velocity_today(meanwinds_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'vertical_velocity_last24':
-                print('Making vertical_velocity_last24')
-                wind_profile_mean_winds_upward_velocity_last24(meanwinds_netcdf_ordered[1], meanwinds_netcdf_ordered[0], output_location = args.output_location)
-            elif i[0] == 'vertical_velocity_last48':
-                print('Making vertical_velocity_last48')
-                wind_profile_mean_winds_upward_velocity_last48(meanwinds_netcdf_ordered[2], meanwinds_netcdf_ordered[1], meanwinds_netcdf_ordered[0], output_location = args.output_location)
-                
-            else:
+        if i[0] not in  ['netCDFs', 'output_location', 'jobs', 'bin_to_pixels', 'backscatter_binning', 'watch', 'poll_interval', 'settle_time', 'force', 'metrics', 'max_memory', 'cache_dir', 'cache_size', 'data_dir', 'catalog', 'site', 'window', 'end', 'also_unfiltered', 'png_compression', 'thumbnail_width', 'image_formats', 'reprocess', 'prefetch', 'manifest']:
+            if i[0] not in PLOT_OPTIONS:
                 print(f'Unexpected option {i}, not sure how to deal with it, skipping... ')
+                continue
+            plots.append(i[0])
+    if args.window is not None:
+        # the same plots, over each window asked for instead
+        plots = list(dict.fromkeys( window_option(option, length) for length in args.window for option in plots ))
+    render_options = {'bin_to_pixels': args.bin_to_pixels, 'backscatter_binning': args.backscatter_binning, 'max_memory': args.max_memory,
+                      'array_cache': None if args.cache_dir is None else ArrayCache(args.cache_dir, args.cache_size), 'also_unfiltered': args.also_unfiltered,
+                      'png_compression': args.png_compression, 'thumbnail_width': args.thumbnail_width, 'image_formats': args.image_formats or []}
+    
+    with (ProcessPoolExecutor(max_workers = args.jobs, initializer = _init_plot_worker) if args.jobs > 1 else nullcontext()) as executor:
+        if args.watch is not None:
+            with open_catalog(args.catalog, args.output_location) as catalog:
+                catalog.update(args.watch)
+                if args.site is None and len(catalog.sites()) > 1:
+                    parser.error(f"--watch has files from several sites ({', '.join(catalog.sites())}), choose one with --site")
+            try:
+                watch(args.watch, plots, args.output_location, args.poll_interval, args.settle_time, executor, args.metrics, args.catalog, args.site,
+                      prefetch = args.prefetch, manifest_file = args.manifest, **render_options)
+            except KeyboardInterrupt:
+                pass
+            sys.exit()
+            
+        if args.reprocess is not None:
+            product_plots = {}
+            for option in plots:
+                product_plots.setdefault(plot_option(option)[0], []).append(option)
+            metrics = None if args.metrics is None else Metrics()
+            with open_catalog(args.catalog, args.output_location) as catalog:
+                catalog.update(args.data_dir)
+                if args.site is None and len(catalog.sites()) > 1:
+                    parser.error(f"--data-dir has files from several sites ({', '.join(catalog.sites())}), choose one with --site")
+                reprocess_failed = reprocess(catalog, *args.reprocess, product_plots, args.output_location, executor, args.jobs, args.force, args.site, metrics, **render_options)
+            if metrics is not None:
+                metrics.write(args.metrics)
+            reprocess_failed = { date: options for date, options in reprocess_failed.items() if options }
+            if reprocess_failed:
+                sys.exit('Failed to make: ' + '; '.join( f"{date}: {', '.join(options)}" for date, options in reprocess_failed.items() ))
+            sys.exit()
+            
+        # all windows end at the same time
+        reference_time = args.end or dt.datetime.now(dt.timezone.utc)
+        os.makedirs(args.output_location, exist_ok = True)
+        
+        # work out which files each product's plots need, oldest first
+        days = max([ window_days(plot_option(option)[1], reference_time) for option in plots ] or [1])
+        catalog = None
+        if args.data_dir is not None:
+            # also gives the times of the files' records, for the manifest
+            catalog = open_catalog(args.catalog, args.output_location)
+            catalog.update(args.data_dir)
+            if args.site is None and len(catalog.sites()) > 1:
+                parser.error(f"--data-dir has files from several sites ({', '.join(catalog.sites())}), choose one with --site")
+            available = { product: catalog_files(catalog, product, reference_time, days, args.site) for product in PRODUCT_FILE_NAMES }
+        else:
+            available = { product: files[::-1] for product, files in netcdf_ordered.items() }
+        # days without a file are left blank, and only plots with no files at all skipped
+        product_plots = {}
+        product_files = {}
+        failed = []
+        for option in plots:
+            product, window = plot_option(option)[:2]
+            files = window_files(available[product], window, reference_time)
+            if not files:
+                print(f'No {product} netCDF files for {option}, skipping... ')
+                failed.append(option)
+                continue
+            product_plots.setdefault(product, []).append(option)
+            if len(files) > len(product_files.get(product, [])):
+                product_files[product] = files
+        
+        # make the requested plots, reading each product's files once
+        metrics = None if args.metrics is None else Metrics()
+        results = make_plots(product_plots, product_files, args.output_location, reference_time, executor, force = args.force, metrics = metrics,
+                             prefetch = args.prefetch, catalog = catalog, manifest_file = args.manifest, **render_options)
+        if catalog is not None:
+            catalog.close()
+        if metrics is not None:
+            metrics.write(args.metrics)
+    
+    for option, error in results.items():
+        if error is not None:
+            print(f'Failed to make {option}:\n{error}', file = sys.stderr)
+            failed.append(option)
+    
+    if failed:
+        sys.exit(f"Failed to make: {', '.join(failed)}")
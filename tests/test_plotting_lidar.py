@@ -0,0 +1,174 @@
+"""
+Tests of plotting_lidar.py, run with
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import plotting_lidar
+
+
+
+def test_bin_grid_time_height_keeps_data_beside_a_masked_gate():
+    # gate 1 has no good data at all, so its time bins are empty after binning time
+    data = np.ma.masked_array(np.ones((4, 8), dtype = np.float32), mask = np.zeros((4, 8), dtype = bool))
+    data.mask[1] = True
+    x, y, binned = plotting_lidar.bin_grid(np.arange(8.), np.arange(4.), data, 2, 2)
+    assert not np.ma.getmaskarray(binned).any()
+    assert np.allclose(binned, 1)
+    
+    
+    
+def test_bin_grid_log_mean_of_a_masked_gate():
+    data = np.ma.masked_array(np.full((4, 8), 10**-5, dtype = np.float32), mask = np.zeros((4, 8), dtype = bool))
+    data.mask[2] = True
+    binned = plotting_lidar.bin_grid(np.arange(8.), np.arange(4.), data, 2, 2, binning = 'log-mean')[2]
+    assert np.allclose(binned, 10**-5)
+    
+    
+    
+def _render(draw):
+    # matplotlib is only imported by the tests that draw
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize = (8, 4), dpi = 100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0.1, 0.1, 0.8, 0.8])
+    draw(ax)
+    ax.set_xlim(-0.5, 59.5)
+    ax.set_ylim(95, 3005)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).astype(int)
+    
+    
+    
+def test_draw_grid_matches_pcolormesh():
+    # a regular time-range grid, drawn as an image by draw_grid
+    x = np.arange(60.)
+    y = np.linspace(100, 3000, 30)
+    data = np.ma.masked_invalid(np.random.default_rng(0).lognormal(-12, 2, (30, 60)))
+    data[5:8, 10:20] = np.ma.masked
+    from matplotlib.colors import LogNorm
+    kwargs = {'cmap': 'viridis', 'norm': LogNorm(10**-7, 10**-3)}
+    assert plotting_lidar.is_regular(x) and plotting_lidar.is_regular(y)
+    image = _render(lambda ax: plotting_lidar.draw_grid(ax, x, y, data, **kwargs))
+    mesh = _render(lambda ax: ax.pcolormesh(x, y, data, shading = 'nearest', **kwargs))
+    assert np.abs(image - mesh).max() <= 1
+    
+    
+    
+def test_window_length_rejects_empty_windows():
+    assert plotting_lidar.window_length('last48') == plotting_lidar.dt.timedelta(hours = 48)
+    assert plotting_lidar.window_length('last7d') == plotting_lidar.dt.timedelta(days = 7)
+    for window in ['last0', 'last0h', 'last0d', 'last', 'last6m']:
+        with pytest.raises(ValueError):
+            plotting_lidar.window_length(window)
+    
+    
+    
+def test_window_files_leaves_out_a_missing_day():
+    files = [ f'ncas-lidar-dop-2_iao_202410{day}_mean-winds-profile_v1.0.nc' for day in ['12', '13', '15'] ]
+    reference_time = plotting_lidar.dt.datetime(2024, 10, 15, 12, tzinfo = plotting_lidar.dt.timezone.utc)
+    assert plotting_lidar.window_files(files, 'last48', reference_time) == files[1:]
+    assert plotting_lidar.window_files(files, 'today', reference_time) == files[2:]
+    assert plotting_lidar.window_files(files, 'today', reference_time - plotting_lidar.dt.timedelta(days = 1)) == []
+    
+    
+    
+def test_gap_between_files_is_blank():
+    parts = [ plotting_lidar.TimeSeries(np.array(times), np.arange(2.), {'v': np.ones((len(times), 2), dtype = np.float32)}, {'v': ''}, [0])
+              for times in [[0., 10., 20.], [10000., 10010.]] ]
+    joined = plotting_lidar.join_time_series(parts)
+    assert np.array_equal(joined.times, [0., 10., 20., 21., 9999., 10000., 10010.])
+    assert np.isnan(joined['v'][3:5]).all() and not np.isnan(joined['v'][[0, 1, 2, 5, 6]]).any()
+    assert joined.window('today').times[0] == 10000.
+    
+    
+    
+def test_metrics_only_resets_peak_rss_in_the_outermost_phase(monkeypatch):
+    resets = []
+    monkeypatch.setattr(plotting_lidar, '_reset_peak_rss', lambda: resets.append(1))
+    metrics = plotting_lidar.Metrics()
+    with metrics.phase('outer'):
+        with metrics.phase('inner'):
+            pass
+        with metrics.phase('inner'):
+            pass
+    with metrics.phase('next'):
+        pass
+    assert len(resets) == 2
+    assert [ record['phase'] for record in metrics.records ] == ['inner', 'inner', 'outer', 'next']
+    
+    
+    
+class _GrowingFile:
+    """
+    A file standing in for a netCDF file still being written, with rows
+    of data as its records, and the slices of them read.
+    """
+    def __init__(self, path, rows):
+        self.path = path
+        self.reads = []
+        self.write(rows)
+        
+    def write(self, rows, mtime_ns = None):
+        self.rows = rows
+        with open(self.path, 'wb') as f:
+            f.write(rows.tobytes())
+        if mtime_ns is not None:
+            os.utime(self.path, ns = (mtime_ns, mtime_ns))
+            
+    def read(self, records):
+        self.reads.append((records.start or 0, len(self.rows) if records.stop is None else records.stop))
+        return self.rows[records]
+        
+    def array(self, cache):
+        return cache.array(self.path, 'data', self.read, lambda: len(self.rows))
+        
+        
+        
+def test_array_cache_reads_only_records_added_to_a_growing_file(tmp_path):
+    cache = plotting_lidar.ArrayCache(str(tmp_path / 'cache'))
+    rows = np.arange(40, dtype = np.float32).reshape(10, 4)
+    f = _GrowingFile(str(tmp_path / 'file.nc'), rows[:6])
+    assert np.array_equal(f.array(cache), rows[:6])
+    f.write(rows)
+    assert np.array_equal(f.array(cache), rows)
+    assert f.reads == [(0, 6), (6, 10)]
+    
+    
+    
+def test_array_cache_reads_a_rewritten_file_again(tmp_path):
+    cache = plotting_lidar.ArrayCache(str(tmp_path / 'cache'))
+    rows = np.arange(40, dtype = np.float32).reshape(10, 4)
+    f = _GrowingFile(str(tmp_path / 'file.nc'), rows[:6])
+    mtime_ns = os.stat(f.path).st_mtime_ns
+    f.array(cache)
+    # fewer records
+    f.write(rows[:4] + 100)
+    assert np.array_equal(f.array(cache), rows[:4] + 100)
+    # as many records, but smaller and older, so rewritten too
+    f.write(rows[:8] + 200)
+    f.array(cache)
+    f.write(rows[:8, :2] + 300, mtime_ns - 10**9)
+    f.rows = rows[:8] + 300
+    assert np.array_equal(f.array(cache), rows[:8] + 300)
+    assert f.reads == [(0, 6), (0, 4), (4, 8), (0, 8)]
+    
+    
+    
+def test_array_cache_reads_an_evicted_growing_entry_again(tmp_path):
+    cache = plotting_lidar.ArrayCache(str(tmp_path / 'cache'))
+    rows = np.arange(40, dtype = np.float32).reshape(10, 4)
+    f = _GrowingFile(str(tmp_path / 'file.nc'), rows[:6])
+    f.array(cache)
+    for entry in (tmp_path / 'cache').glob('*.growing'):
+        entry.unlink()
+    f.write(rows)
+    assert np.array_equal(f.array(cache), rows)
+    assert f.reads == [(0, 6), (0, 10)]